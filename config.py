@@ -31,6 +31,9 @@ WEATHER_HISTORY_FILE = Path("/root/telegram-bot/weather_history.json")
 # Файл результатов RAG сравнений
 RAG_COMPARISON_FILE = Path("/root/telegram-bot/rag_comparisons.json")
 
+# Дисковый кэш ответов Claude для ревью PR (ключ - SHA256 запроса)
+LLM_CACHE_DIR = Path("/root/telegram-bot/.llm_cache")
+
 # =============================================================================
 # Настройки истории разговоров
 # =============================================================================
@@ -76,6 +79,9 @@ MCP_OLLAMA_SERVER_PATH = "/Users/vkuzmin/mcp-servers/ollama-mcp/server.js"
 MCP_OLLAMA_ENV = {
     "VECTOR_STORE_DIR": "/Users/vkuzmin/vector_stores"
 }
+# HTTPS адрес MCP сервера с JSON-RPC на POST /rpc (HTTP/2).
+# Если не задан - сервер запускается через SSH и работает по stdio
+MCP_OLLAMA_HTTP_URL = os.getenv("MCP_OLLAMA_HTTP_URL")
 
 # =============================================================================
 # Ollama Local LLM Configuration (dedicated server 157.22.241.102)
@@ -146,6 +152,7 @@ ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "1081034562"))
 # Task MCP Configuration
 MCP_TASK_NODE_PATH = "/usr/bin/node"
 MCP_TASK_SERVER_PATH = "/home/claude/mcp-task-server/server.js"
+MCP_TASK_HTTP_URL = os.getenv("MCP_TASK_HTTP_URL")  # HTTP/2 вместо stdio, если задан
 
 # =============================================================================
 # Local LLM System Prompt (специализация под бота)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+Конфигурация gunicorn для webhook сервера
+
+Запуск: gunicorn webhook_server:app -c gunicorn_conf.py
+
+Обработчик webhook только проверяет подпись и ставит ревью в фоновый пул,
+поэтому хватает потоковых (gthread) воркеров: пока один поток читает тело
+и считает HMAC (OpenSSL отпускает GIL), остальные принимают соединения.
+Async сервер (Quart/uvicorn) здесь ничего не даёт, а gevent конфликтовал бы
+с event loop ревью (handlers/pr_review.py)
+
+Воркер ровно один: дедупликация доставок, очередь и лимиты ревью живут
+в памяти процесса (webhook_server.py). Со вторым воркером повторная доставка
+GitHub, попавшая в другой процесс, запустила бы второе ревью того же PR.
+Параллельность запросов дают потоки (threads)
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('WEBHOOK_PORT', 8080)}"
+workers = 1
+worker_class = 'gthread'
+threads = 8
+keepalive = 75
+timeout = 120
+
+accesslog = '/var/log/webhook-server-access.log'
+errorlog = '/var/log/webhook-server-error.log'
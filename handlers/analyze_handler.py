@@ -52,7 +52,8 @@ async def analyze_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     question = " ".join(args)
     
     # Проверить доступность локальной LLM
-    from mcp_clients import ollama_local_chat_client
+    from mcp_clients import get_ollama_local_chat_client
+    ollama_local_chat_client = get_ollama_local_chat_client()
     
     if ollama_local_chat_client is None:
         await update.message.reply_text(
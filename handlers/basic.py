@@ -5,15 +5,21 @@ Basic Handlers - базовые команды бота
 """
 
 import logging
-import anthropic
 from telegram import Update
 from telegram.ext import ContextTypes
-from config import ANTHROPIC_API_KEY
 from utils.conversation_manager import get_conversation_history, save_conversation_history, compress_history_if_needed
+from utils.helpers import send_streaming_message, get_anthropic_client
 
 logger = logging.getLogger(__name__)
 
 
+async def _claude_text_stream(**kwargs):
+    """Фрагменты ответа Claude по мере генерации (async iterator для send_streaming_message)"""
+    async with get_anthropic_client().messages.stream(**kwargs) as stream:
+        async for text in stream.text_stream:
+            yield text
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
     await update.message.reply_text(
@@ -81,7 +87,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         if current_mode == "local":
             # ========== ЛОКАЛЬНЫЙ РЕЖИМ (Ollama) ==========
-            from mcp_clients import ollama_local_chat_client
+            from mcp_clients import get_ollama_local_chat_client
+            ollama_local_chat_client = get_ollama_local_chat_client()
             
             if ollama_local_chat_client is None:
                 await update.message.reply_text(
@@ -91,6 +98,15 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
                 return
             
+            # Circuit breaker открыт - не ждём таймаута, сразу сообщаем
+            if ollama_local_chat_client.circuit_open:
+                await update.message.reply_text(
+                    "⏳ Локальная LLM: сервис недоступен, повтори через минуту.\n\n"
+                    "Или переключись на Claude: `/mode claude`",
+                    parse_mode='Markdown'
+                )
+                return
+            
             # Загрузить историю локального режима
             local_history = load_local_history(user_id)
             messages = local_history.get("messages", [])
@@ -114,14 +130,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if len(messages) > 20:
                 messages = messages[-20:]
             
-            # Запрос к Ollama
-            response = await ollama_local_chat_client.chat(
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1024
+            # Потоковый запрос к Ollama: ответ появляется по мере генерации
+            response = await send_streaming_message(
+                update,
+                ollama_local_chat_client.chat(
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=1024
+                )
             )
             
-            if response is None:
+            if not response:
                 await update.message.reply_text(
                     "❌ Ошибка при обращении к локальной LLM.\n\n"
                     "Попробуй ещё раз или переключись на Claude:\n"
@@ -141,12 +160,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             local_history["message_count"] = len(messages)
             save_local_history(user_id, local_history)
             
-            # Отправить ответ пользователю
-            try:
-                await update.message.reply_text(response, parse_mode='Markdown')
-            except Exception:
-                await update.message.reply_text(response)
-            
             logger.info(f"Local mode response sent to user {user_id} ({len(response)} chars)")
             
         else:
@@ -163,10 +176,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Сжать историю если нужно
             conversation_history = compress_history_if_needed(conversation_history, user_id)
             
-            # Запрос к Claude API
-            client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-            
-            message = client.messages.create(
+            # Потоковый запрос к Claude API: ответ появляется по мере генерации
+            assistant_response = await send_streaming_message(update, _claude_text_stream(
                 model="claude-sonnet-4-20250514",
                 max_tokens=4096,
                 temperature=0.3,
@@ -206,9 +217,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 - Документирование неудач и решений
 
 Отвечай на русском. Когда спрашивают о владельце бота, используй эту информацию."""
-            )
+            ))
             
-            assistant_response = message.content[0].text
+            if not assistant_response:
+                await update.message.reply_text("❌ Claude вернул пустой ответ. Попробуй ещё раз.")
+                return
             
             # Добавить ответ в историю
             conversation_history.append({
@@ -219,12 +232,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Сохранить обновлённую историю
             save_conversation_history(user_id, conversation_history)
             
-            # Отправить ответ пользователю
-            try:
-                await update.message.reply_text(assistant_response, parse_mode='Markdown')
-            except Exception:
-                await update.message.reply_text(assistant_response)
-            
             logger.info(f"Claude response sent to user {user_id} ({len(assistant_response)} chars)")
     
     except Exception as e:
@@ -108,7 +108,8 @@ async def mode_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Проверка доступности Ollama для local режима
     if new_mode == "local":
-        from mcp_clients import ollama_local_chat_client
+        from mcp_clients import get_ollama_local_chat_client
+        ollama_local_chat_client = get_ollama_local_chat_client()
         if ollama_local_chat_client is None:
             await update.message.reply_text(
                 "❌ Локальная LLM недоступна. Ollama client не инициализирован.\n\n"
@@ -4,8 +4,14 @@ Handler для автоматического code review Pull Request
 Отправляет уведомления в Telegram
 """
 
+import os
+import json
 import logging
+import atexit
 import asyncio
+import hashlib
+import tempfile
+import threading
 from anthropic import Anthropic
 from telegram import Bot
 from config import (
@@ -14,9 +20,12 @@ from config import (
     GITHUB_REPO_NAME, 
     RAG_VECTOR_STORE_NAME,
     ADMIN_CHAT_ID,
-    TELEGRAM_TOKEN
+    TELEGRAM_TOKEN,
+    REVIEW_MODEL,
+    REVIEW_TEMPERATURE,
+    LLM_CACHE_DIR
 )
-from utils.github_api import post_pr_comment, get_pr_diff
+from utils.github_api import post_pr_comment, get_pr_diff, close_session
 from utils.rag_functions import get_rag_answer
 # from mcp_clients.github_client import mcp_github_client  # TODO: добавить позже
 
@@ -28,6 +37,36 @@ client = Anthropic(api_key=ANTHROPIC_API_KEY)
 # Инициализация Telegram Bot для уведомлений
 telegram_bot = Bot(token=TELEGRAM_TOKEN)
 
+# Общий event loop для всех ревью: сессия GitHub API (keep-alive, TLS)
+# переживает отдельный ревью, вместо нового handshake на каждый PR
+_review_loop = None
+_review_loop_lock = threading.Lock()
+
+
+def _get_review_loop():
+    """Получить (или запустить в фоновом потоке) общий event loop ревью"""
+    global _review_loop
+    with _review_loop_lock:
+        if _review_loop is None:
+            _review_loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_review_loop.run_forever, name='pr-review-loop', daemon=True
+            ).start()
+            atexit.register(_shutdown_review_loop)
+        return _review_loop
+
+
+def _shutdown_review_loop():
+    """Закрыть сессию GitHub API и остановить loop ревью (при выходе процесса)"""
+    loop = _review_loop
+    if loop is None or not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(close_session(), loop).result(timeout=5.0)
+    except Exception as e:
+        logger.warning(f"Ошибка при закрытии сессии GitHub API: {e}")
+    loop.call_soon_threadsafe(loop.stop)
+
 def process_pr_review(webhook_payload):
     """
     Основная функция обработки PR для ревью
@@ -49,13 +88,14 @@ def process_pr_review(webhook_payload):
         
         logger.info(f"Начинаю ревью PR #{pr_number}: {pr_title}")
         
-        # Запускаем асинхронную обработку
-        asyncio.run(
+        # Запускаем в общем event loop и ждём завершения (поток executor'а webhook)
+        asyncio.run_coroutine_threadsafe(
             review_pull_request(
                 repo_owner, repo_name, pr_number,
                 pr_title, pr_description, pr_author, pr_url
-            )
-        )
+            ),
+            _get_review_loop()
+        ).result()
         
     except Exception as e:
         logger.error(f"Ошибка в process_pr_review: {e}", exc_info=True)
@@ -280,7 +320,8 @@ async def get_rag_context(pr_title, diff_content):
         if diff_content:
             # Извлекаем изменённые файлы из diff
             files = []
-            for line in diff_content.split('\n')[:20]:  # Первые 20 строк
+            # maxsplit: не режем весь diff ради первых 20 строк
+            for line in diff_content.split('\n', 20)[:20]:  # Первые 20 строк
                 if line.startswith('diff --git'):
                     # Пример: diff --git a/config.py b/config.py
                     parts = line.split()
@@ -417,6 +458,35 @@ def build_review_prompt(
 """
     return prompt
 
+def _review_cache_path(prompt):
+    """Путь к кэшу ответа: SHA256(model|prompt|temperature)"""
+    key = hashlib.sha256(
+        f"{REVIEW_MODEL}|{prompt}|{REVIEW_TEMPERATURE}".encode()
+    ).hexdigest()
+    return LLM_CACHE_DIR / f"{key}.json"
+
+def _load_cached_review(prompt):
+    """Прочитать ревью из кэша (None если нет)"""
+    try:
+        with open(_review_cache_path(prompt), 'r', encoding='utf-8') as f:
+            return json.load(f)['review_text']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_cached_review(prompt, review_text, tokens_used):
+    """Атомарно записать ревью в кэш (temp файл + rename)"""
+    try:
+        LLM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=LLM_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(
+                {"review_text": review_text, "tokens_used": tokens_used},
+                f, ensure_ascii=False
+            )
+        os.replace(tmp_path, _review_cache_path(prompt))
+    except OSError as e:
+        logger.warning(f"Не удалось сохранить ревью в кэш: {e}")
+
 async def get_claude_review(prompt):
     """
     Получение ревью от Claude
@@ -427,11 +497,19 @@ async def get_claude_review(prompt):
     Returns:
         str: Текст ревью
     """
+    # Тот же промпт (повторная доставка webhook, тот же diff) - ответ из кэша
+    cached = _load_cached_review(prompt)
+    if cached is not None:
+        logger.info("Ревью найдено в кэше, запрос к Claude пропущен")
+        return cached
+    
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
+        # Синхронный клиент - в поток, чтобы не блокировать event loop ревью
+        response = await asyncio.to_thread(
+            client.messages.create,
+            model=REVIEW_MODEL,
             max_tokens=4000,
-            temperature=0.3,
+            temperature=REVIEW_TEMPERATURE,
             messages=[
                 {
                     "role": "user",
@@ -441,6 +519,10 @@ async def get_claude_review(prompt):
         )
         
         review_text = response.content[0].text
+        _save_cached_review(
+            prompt, review_text,
+            response.usage.input_tokens + response.usage.output_tokens
+        )
         return review_text
         
     except Exception as e:
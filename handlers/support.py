@@ -5,8 +5,7 @@ Support handler - обработка вопросов пользователей
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from anthropic import AsyncAnthropic
-from config import ANTHROPIC_API_KEY, CLAUDE_MODEL
+from config import CLAUDE_MODEL
 from utils.crm_functions import (
     create_or_update_user,
     get_user_tickets,
@@ -15,9 +14,9 @@ from utils.crm_functions import (
     get_ticket_context
 )
 from utils.rag_functions import get_rag_answer
+from utils.helpers import get_anthropic_client
 
 logger = logging.getLogger(__name__)
-client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
 
 
 async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -107,7 +106,7 @@ async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_prompt = f"**Вопрос пользователя:** {question}"
         
         # 5. Запрос к Claude
-        response = await client.messages.create(
+        response = await get_anthropic_client().messages.create(
             model=CLAUDE_MODEL,
             max_tokens=2000,
             temperature=0.3,
@@ -1,8 +1,7 @@
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-import anthropic
-from config import ANTHROPIC_API_KEY
+from utils.helpers import get_anthropic_client
 
 logger = logging.getLogger(__name__)
 
@@ -12,8 +11,8 @@ async def handle_tasks_command(update: Update, context: ContextTypes.DEFAULT_TYP
     
     try:
         # Динамический импорт для получения актуального клиента
-        import mcp_clients
-        from mcp_clients import mcp_task_client
+        from mcp_clients import get_task_client
+        mcp_task_client = get_task_client()
         
         logger.info(f"[TASKS] mcp_task_client type: {type(mcp_task_client)}")
         
@@ -95,8 +94,8 @@ async def handle_tasks_command(update: Update, context: ContextTypes.DEFAULT_TYP
 async def handle_task_create_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Создать новую задачу"""
     try:
-        import mcp_clients
-        from mcp_clients import mcp_task_client
+        from mcp_clients import get_task_client
+        mcp_task_client = get_task_client()
         
         if mcp_task_client is None:
             await update.message.reply_text("❌ Task MCP не инициализирован")
@@ -149,8 +148,8 @@ async def handle_task_create_command(update: Update, context: ContextTypes.DEFAU
 async def handle_task_update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обновить задачу"""
     try:
-        import mcp_clients
-        from mcp_clients import mcp_task_client
+        from mcp_clients import get_task_client
+        mcp_task_client = get_task_client()
         
         if mcp_task_client is None:
             await update.message.reply_text("❌ Task MCP не инициализирован")
@@ -199,8 +198,8 @@ async def handle_task_update_command(update: Update, context: ContextTypes.DEFAU
 async def handle_ask_team_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Умный ассистент с RAG + Tasks + Claude"""
     try:
-        import mcp_clients
-        from mcp_clients import mcp_task_client
+        from mcp_clients import get_task_client
+        mcp_task_client = get_task_client()
         
         if not context.args:
             await update.message.reply_text(
@@ -256,8 +255,7 @@ async def handle_ask_team_command(update: Update, context: ContextTypes.DEFAULT_
 Ответь кратко и по делу."""
 
         # Запрос к Claude
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        message = client.messages.create(
+        message = await get_anthropic_client().messages.create(
             model="claude-sonnet-4-20250514",
             max_tokens=1024,
             temperature=0.3,
@@ -8,6 +8,7 @@ import tempfile
 from telegram import Update
 from telegram.ext import ContextTypes
 from faster_whisper import WhisperModel
+from utils.helpers import get_anthropic_client
 
 logger = logging.getLogger(__name__)
 
@@ -109,7 +110,8 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if current_mode == "local":
             # Local LLM
-            from mcp_clients import ollama_local_chat_client
+            from mcp_clients import get_ollama_local_chat_client
+            ollama_local_chat_client = get_ollama_local_chat_client()
             from handlers.local_mode import load_local_history, save_local_history
             
             if ollama_local_chat_client is None:
@@ -126,7 +128,7 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 messages = messages[-20:]
             
             # Запрос к Ollama
-            response = await ollama_local_chat_client.chat(
+            response = await ollama_local_chat_client.chat_full(
                 messages=messages,
                 temperature=0.7,
                 max_tokens=1024
@@ -140,17 +142,14 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         else:
             # Claude режим
-            import anthropic
             from utils.conversation_manager import get_conversation_history, save_conversation_history, compress_history_if_needed
-            from config import ANTHROPIC_API_KEY
             
             conversation_history = get_conversation_history(user_id)
             conversation_history.append({"role": "user", "content": recognized_text})
             conversation_history = compress_history_if_needed(conversation_history, user_id)
             
             # Запрос к Claude
-            client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-            message = client.messages.create(
+            message = await get_anthropic_client().messages.create(
                 model="claude-sonnet-4-20250514",
                 max_tokens=4096,
                 temperature=0.3,
@@ -1,7 +1,6 @@
 import asyncio
 import sys
 import os
-import re
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
@@ -37,7 +36,8 @@ async def load_faq():
     
     # Разбиваем на секции по заголовкам ###
     print("✂️ Разбиваю на секции...")
-    sections = re.split(r'\n### ', faq_text)
+    # Разделитель - фиксированная строка, str.split быстрее regex
+    sections = faq_text.split('\n### ')
     
     # Первая секция содержит заголовок ##, обрабатываем отдельно
     all_chunks = []
@@ -2,12 +2,13 @@ import asyncio
 import sys
 sys.path.insert(0, '/root/telegram-bot')
 
-from mcp_clients import init_mcp_clients, mcp_ollama_rag_client, shutdown_mcp_clients
+from mcp_clients import init_mcp_clients, get_ollama_client, shutdown_mcp_clients
 from telegram.ext import Application
 
 async def main():
     app = Application.builder().token('dummy').build()
     await init_mcp_clients(app)
+    mcp_ollama_rag_client = get_ollama_client()
     
     profile = '''Виктор Кузьмин - Senior Developer, Systems Architect.
 Стиль работы: прагматичный, итеративный, экспериментальный.
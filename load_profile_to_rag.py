@@ -5,13 +5,14 @@ import sys
 
 sys.path.insert(0, "/root/telegram-bot")
 
-from mcp_clients import init_mcp_clients, mcp_ollama_rag_client, shutdown_mcp_clients
+from mcp_clients import init_mcp_clients, get_ollama_client, shutdown_mcp_clients
 from telegram.ext import Application
 
 async def load_profile():
     print("Initializing MCP clients...")
     app = Application.builder().token("dummy").build()
     await init_mcp_clients(app)
+    mcp_ollama_rag_client = get_ollama_client()
     
     if mcp_ollama_rag_client is None:
         print("❌ Ollama RAG client not available")
@@ -2,33 +2,44 @@
 MCP клиенты для различных сервисов
 """
 
+import asyncio
 import logging
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
 
 from .weather_client import MCPWeatherClient
 from .news_client import MCPNewsClient
 from .mobile_client import MCPMobileClient
 from .ollama_client import MCPOllamaClient
 from .github_client import MCPGitHubClient
+from .task_client import TaskMCPClient
+from .ollama_chat_client import OllamaLocalChatClient
 
 logger = logging.getLogger(__name__)
 
-# Глобальные клиенты
-mcp_weather_client = None
-mcp_news_client = None
-mcp_mobile_client = None
-mcp_ollama_client = None
-mcp_github_client = None
+
+class MCPRegistry:
+    """Реестр запущенных клиентов (заполняется в init_mcp_clients)"""
+    
+    __slots__ = ('weather', 'news', 'mobile', 'ollama', 'github', 'task', 'ollama_local', 'bot')
+    
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, None)
+
+
+registry = MCPRegistry()
 scheduler = None
-bot_instance = None
+
+
+def _create_scheduler():
+    """Создать планировщик (apscheduler импортируется только при использовании)"""
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+    return AsyncIOScheduler()
 
 
 async def init_ollama_local_chat_client():
-    global ollama_local_chat_client
     logger.info("Starting Ollama Local Chat Client...")
-    ollama_local_chat_client = OllamaLocalChatClient()
-    success = await ollama_local_chat_client.start()
+    registry.ollama_local = OllamaLocalChatClient()
+    success = await registry.ollama_local.start()
     if success:
         logger.info("✓ Ollama Local Chat Client initialized")
     else:
@@ -36,13 +47,23 @@ async def init_ollama_local_chat_client():
     return success
 
 
+async def init_task_client():
+    logger.info("Starting Task MCP Client...")
+    from config import MCP_TASK_HTTP_URL
+    registry.task = TaskMCPClient(http_url=MCP_TASK_HTTP_URL)
+    success = await registry.task.start()
+    if success:
+        logger.info("✓ Task MCP Client initialized")
+    else:
+        logger.error("✗ Task MCP Client failed to initialize")
+        registry.task = None
+    return success
+
+
 async def init_mcp_clients(app):
     """
     Инициализация всех MCP клиентов при старте бота
     """
-    global mcp_weather_client, mcp_news_client, mcp_mobile_client, mcp_ollama_client, mcp_github_client
-    global scheduler, bot_instance
-    
     from config import (
         MCP_WEATHER_SERVER_PATH,
         MCP_NEWS_SERVER_PATH,
@@ -58,6 +79,7 @@ async def init_mcp_clients(app):
         MCP_OLLAMA_SSH_KEY,
         MCP_OLLAMA_NODE_PATH,
         MCP_OLLAMA_SERVER_PATH,
+        MCP_OLLAMA_HTTP_URL,
         MCP_GITHUB_SERVER_PATH,
         GITHUB_TOKEN,
         GITHUB_REPO_OWNER,
@@ -65,57 +87,54 @@ async def init_mcp_clients(app):
     )
     
     # Сохраняем экземпляр бота для использования в scheduled задачах
-    bot_instance = app.bot
+    registry.bot = app.bot
     
     # Запускаем MCP Weather Client
     logger.info("Starting MCP Weather Client...")
-    mcp_weather_client = MCPWeatherClient(MCP_WEATHER_SERVER_PATH)
-    if await mcp_weather_client.start():
+    registry.weather = MCPWeatherClient(MCP_WEATHER_SERVER_PATH)
+    if await registry.weather.start():
         logger.info("✓ MCP Weather Client initialized")
     else:
         logger.error("✗ Failed to start MCP Weather Client")
     
     # Запускаем MCP News Client
     logger.info("Starting MCP News Client...")
-    mcp_news_client = MCPNewsClient(MCP_NEWS_SERVER_PATH)
-    if await mcp_news_client.start():
+    registry.news = MCPNewsClient(MCP_NEWS_SERVER_PATH)
+    if await registry.news.start():
         logger.info("✓ MCP News Client initialized")
     else:
         logger.error("✗ Failed to start MCP News Client")
     
     # Запускаем MCP Mobile Client
     logger.info("Starting MCP Mobile Client...")
-    mcp_mobile_client = MCPMobileClient(
+    registry.mobile = MCPMobileClient(
         ssh_host=MCP_MOBILE_SSH_HOST,
         ssh_port=MCP_MOBILE_SSH_PORT,
         ssh_user=MCP_MOBILE_SSH_USER,
         ssh_key=MCP_MOBILE_SSH_KEY,
         server_path=MCP_MOBILE_SERVER_PATH
     )
-    if await mcp_mobile_client.start():
+    if await registry.mobile.start():
         logger.info("✓ MCP Mobile Client initialized")
     else:
         logger.error("✗ Failed to start MCP Mobile Client")
     
     # Запускаем MCP Ollama Client
     logger.info("Starting MCP Ollama Client...")
-    mcp_ollama_client = MCPOllamaClient(
+    registry.ollama = MCPOllamaClient(
         ssh_host=MCP_OLLAMA_SSH_HOST,
         ssh_port=MCP_OLLAMA_SSH_PORT,
         ssh_user=MCP_OLLAMA_SSH_USER,
         ssh_key=MCP_OLLAMA_SSH_KEY,
         node_path=MCP_OLLAMA_NODE_PATH,
-        server_path=MCP_OLLAMA_SERVER_PATH
+        server_path=MCP_OLLAMA_SERVER_PATH,
+        http_url=MCP_OLLAMA_HTTP_URL
     )
-    if await mcp_ollama_client.start():
+    if await registry.ollama.start():
         logger.info("✓ MCP Ollama Client initialized")
 
         from utils.rag_functions import set_ollama_client
-        set_ollama_client(mcp_ollama_client)
-        from utils.github_rag_functions import set_github_client
-        if mcp_github_client:
-            set_github_client(mcp_github_client)
-            logger.info("✓ GitHub RAG functions configured")
+        set_ollama_client(registry.ollama)
         logger.info("✓ RAG functions configured with Ollama client")
     else:
         logger.error("✗ Failed to start MCP Ollama Client")
@@ -123,14 +142,14 @@ async def init_mcp_clients(app):
     # Запускаем MCP GitHub Client
     logger.info("Starting MCP GitHub Client...")
     if GITHUB_TOKEN:
-        mcp_github_client = MCPGitHubClient(
+        registry.github = MCPGitHubClient(
             server_path=MCP_GITHUB_SERVER_PATH,
             github_token=GITHUB_TOKEN
         )
-        if await mcp_github_client.start():
+        if await registry.github.start():
             logger.info("✓ MCP GitHub Client initialized")
             from utils.github_rag_functions import set_github_client
-            set_github_client(mcp_github_client)
+            set_github_client(registry.github)
             logger.info("✓ GitHub RAG functions configured")
         else:
             logger.error("✗ Failed to start MCP GitHub Client")
@@ -141,11 +160,12 @@ async def init_mcp_clients(app):
     await init_task_client()
     await init_ollama_local_chat_client()
 
-    # Инициализация планировщика
-    scheduler = AsyncIOScheduler()
+    # Инициализация планировщика (отключено - задач пока нет)
+#    scheduler = _create_scheduler()
     
     # Импортируем функцию утренней рассылки
 #    from handlers.basic import send_morning_weather
+#    from apscheduler.triggers.cron import CronTrigger
     
     # Добавляем задачу утренней рассылки (каждый день в 8:00)
  #   scheduler.add_job(
@@ -164,68 +184,74 @@ async def shutdown_mcp_clients(app):
     """
     Остановка всех MCP клиентов при завершении работы бота
     """
-    global mcp_weather_client, mcp_news_client, mcp_mobile_client, mcp_ollama_client, mcp_github_client, scheduler
-    
-    if mcp_weather_client:
-        await mcp_weather_client.stop()
-        logger.info("✓ MCP Weather Client stopped")
+    clients = [
+        ("MCP Weather Client", registry.weather),
+        ("MCP News Client", registry.news),
+        ("MCP Mobile Client", registry.mobile),
+        ("MCP Ollama Client", registry.ollama),
+        ("MCP GitHub Client", registry.github),
+        ("Task MCP Client", registry.task),
+        ("Ollama Local Chat Client", registry.ollama_local),
+    ]
+    clients = [(name, client) for name, client in clients if client]
     
-    if mcp_news_client:
-        await mcp_news_client.stop()
-        logger.info("✓ MCP News Client stopped")
-    
-    if mcp_mobile_client:
-        await mcp_mobile_client.stop()
-        logger.info("✓ MCP Mobile Client stopped")
-    
-    if mcp_ollama_client:
-        await mcp_ollama_client.stop()
-        logger.info("✓ MCP Ollama Client stopped")
+    # Останавливаем параллельно: каждый stop() может ждать до 5 секунд
+    results = await asyncio.gather(
+        *(client.stop() for _, client in clients),
+        return_exceptions=True
+    )
+    for (name, _), result in zip(clients, results):
+        if isinstance(result, Exception):
+            logger.error(f"✗ Failed to stop {name}: {result}")
+        else:
+            logger.info(f"✓ {name} stopped")
     
-    if mcp_github_client:
-        await mcp_github_client.stop()
-        logger.info("✓ MCP GitHub Client stopped")
-
-    if mcp_task_client:
-        await mcp_task_client.stop()
-        logger.info("✓ Task MCP Client stopped")
+    # Общие SSH соединения Mobile/Ollama закрываем после их каналов
+    from ._ssh_pool import close_all as close_ssh_connections
+    await close_ssh_connections()
     
 #    if scheduler:
 #        scheduler.shutdown()
 #        logger.info("✓ Scheduler stopped")
-    if ollama_local_chat_client:
-        await ollama_local_chat_client.stop()
-        logger.info("✓ Ollama Local Chat Client stopped")
-#
 
 def get_weather_client():
     """Получить экземпляр Weather клиента"""
-    return mcp_weather_client
+    return registry.weather
 
 
 def get_news_client():
     """Получить экземпляр News клиента"""
-    return mcp_news_client
+    return registry.news
 
 
 def get_mobile_client():
     """Получить экземпляр Mobile клиента"""
-    return mcp_mobile_client
+    return registry.mobile
 
 
 def get_ollama_client():
     """Получить экземпляр Ollama клиента"""
-    return mcp_ollama_client
+    return registry.ollama
 
 
 def get_github_client():
     """Получить экземпляр GitHub клиента"""
-    return mcp_github_client
+    return registry.github
+
+
+def get_task_client():
+    """Получить экземпляр Task клиента"""
+    return registry.task
+
+
+def get_ollama_local_chat_client():
+    """Получить экземпляр клиента локальной LLM"""
+    return registry.ollama_local
 
 
 def get_bot_instance():
     """Получить экземпляр бота для scheduled задач"""
-    return bot_instance
+    return registry.bot
 
 
 __all__ = [
@@ -234,6 +260,10 @@ __all__ = [
     'MCPMobileClient',
     'MCPOllamaClient',
     'MCPGitHubClient',
+    'TaskMCPClient',
+    'OllamaLocalChatClient',
+    'MCPRegistry',
+    'registry',
     'init_mcp_clients',
     'shutdown_mcp_clients',
     'get_weather_client',
@@ -241,24 +271,7 @@ __all__ = [
     'get_mobile_client',
     'get_ollama_client',
     'get_github_client',
+    'get_task_client',
+    'get_ollama_local_chat_client',
     'get_bot_instance'
 ]
-
-# Task MCP Client
-from mcp_clients.task_client import TaskMCPClient
-from mcp_clients.ollama_chat_client import OllamaLocalChatClient
-
-mcp_task_client = None
-ollama_local_chat_client = None
-
-async def init_task_client():
-    global mcp_task_client
-    logger.info("Starting Task MCP Client...")
-    mcp_task_client = TaskMCPClient()
-    success = await mcp_task_client.start()
-    if success:
-        logger.info("✓ Task MCP Client initialized")
-    else:
-        logger.error("✗ Task MCP Client failed to initialize")
-        mcp_task_client = None
-    return success
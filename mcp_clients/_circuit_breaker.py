@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Circuit breaker для удалённых LLM эндпоинтов
+
+CLOSED    - запросы проходят, считаем подряд идущие ошибки
+OPEN      - после failure_threshold ошибок запросы сразу отклоняются
+HALF_OPEN - по истечении recovery_timeout пропускаем один пробный запрос
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Счётчик ошибок с быстрым отказом на время недоступности сервиса"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def is_open(self) -> bool:
+        """Отклоняются ли запросы сейчас (без перехода в HALF_OPEN)"""
+        return (self.state != self.CLOSED
+                and time.monotonic() - self.opened_at < self.recovery_timeout)
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнять запрос сейчас"""
+        if self.state == self.CLOSED:
+            return True
+        # OPEN: ждём recovery_timeout. HALF_OPEN: пробный запрос уже идёт,
+        # остальные отклоняются (если проба "потерялась" - через тот же таймаут новая)
+        now = time.monotonic()
+        if now - self.opened_at < self.recovery_timeout:
+            return False
+        self.state = self.HALF_OPEN
+        self.opened_at = now
+        logger.info(f"{self.name}: circuit half-open, probing")
+        return True
+
+    def record_success(self):
+        """Запрос успешен - закрываем цепь"""
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name}: circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        """Запрос неуспешен - при достижении порога открываем цепь"""
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"{self.name}: circuit open for {self.recovery_timeout:.0f}s "
+                    f"after {self.failures} failures"
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
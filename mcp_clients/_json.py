@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSON для JSON-RPC обмена с MCP серверами
+
+orjson (Rust) в 2-5 раз быстрее stdlib json и сразу работает с bytes.
+Если orjson не установлен - используется stdlib json с тем же интерфейсом
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError - подкласс json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
+
+# Лимит одной строки JSON-RPC в stdout сервера. У asyncio по умолчанию 64 KiB:
+# ответ RAG с чанками и эмбеддингами превышает его ("Separator is not found")
+MAX_LINE_SIZE = 10 * 1024 * 1024
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        """Сериализовать объект в bytes"""
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+else:
+    def dumps(obj) -> bytes:
+        """Сериализовать объект в bytes"""
+        return json.dumps(obj, ensure_ascii=False).encode()
+
+    loads = json.loads
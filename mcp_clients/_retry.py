@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Повтор удалённых вызовов с экспоненциальной задержкой и jitter
+"""
+
+import json
+import random
+import asyncio
+import logging
+
+import aiohttp
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Транзиентные ошибки: таймаут, обрыв соединения/pipe, битый JSON.
+# HTTP 4xx и ошибки MCP (поле "error" в ответе) не повторяем
+RETRYABLE_ERRORS = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    aiohttp.ClientConnectionError,
+    httpx.TransportError,
+    json.JSONDecodeError,
+)
+
+# Инструменты MCP только на чтение: повтор после таймаута безопасен.
+# Изменяющие вызовы (create_task, vector_store_save, ...) могли уже выполниться
+# на сервере - их повтор создаст дубликаты, поэтому они отправляются один раз
+READ_ONLY_PREFIXES = ('get_', 'list_', 'search_', 'rag_')
+READ_ONLY_TOOLS = frozenset({'vector_store_load'})
+
+
+def is_read_only(tool_name: str) -> bool:
+    """Можно ли безопасно повторить вызов инструмента"""
+    return tool_name in READ_ONLY_TOOLS or tool_name.startswith(READ_ONLY_PREFIXES)
+
+
+async def retry(coro_factory, max_retries: int = 3, base: float = 0.2, cap: float = 4.0,
+                idempotent: bool = True):
+    """
+    Выполнить coro_factory() с повторами при транзиентных ошибках
+
+    Args:
+        coro_factory: функция без аргументов, возвращающая новую корутину
+        max_retries: количество повторов после первой попытки
+        base: базовая задержка (секунды), удваивается с каждой попыткой
+        cap: максимальная задержка без учёта jitter
+        idempotent: False - вызов изменяет состояние и выполняется один раз
+    """
+    if not idempotent:
+        max_retries = 0
+    for attempt in range(max_retries + 1):
+        try:
+            return await coro_factory()
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            delay = min(cap, base * 2 ** attempt) + random.uniform(0, base)
+            logger.warning(
+                f"Transient error ({type(e).__name__}: {e}), "
+                f"retry {attempt + 1}/{max_retries} in {delay:.2f}s"
+            )
+            await asyncio.sleep(delay)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSH пул - одно asyncssh соединение на (user, host, port)
+Mobile и Ollama MCP серверы мультиплексируются поверх общего соединения
+
+Если asyncssh не установлен - используется OpenSSH с ControlMaster:
+первый клиент создаёт master-соединение, остальные идут через его сокет
+"""
+
+import os
+import asyncio
+import logging
+
+from . import _json
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+logger = logging.getLogger(__name__)
+
+_pools = {}  # (user, host, port) -> asyncssh.SSHClientConnection
+_pool_lock = asyncio.Lock()
+
+# OpenSSH ControlMaster (fallback без asyncssh)
+SSH_CONTROL_DIR = "/tmp/ssh-mcp"
+SSH_CONTROL_PATH = f"{SSH_CONTROL_DIR}/%r@%h:%p"
+SSH_CONTROL_PERSIST = 600
+_control_targets = set()  # (user, host, port, key) с активным master
+
+
+async def get_conn(host: str, port: int, user: str, key: str):
+    """Получить (или открыть) общее SSH соединение"""
+    pool_key = (user, host, port)
+    async with _pool_lock:
+        conn = _pools.get(pool_key)
+        if conn is None:
+            logger.info(f"Opening SSH connection to {user}@{host}:{port}")
+            conn = await asyncssh.connect(
+                host,
+                port=port,
+                username=user,
+                client_keys=[key],
+                known_hosts=None
+            )
+            _pools[pool_key] = conn
+            # Разорванное соединение убираем из пула, следующий start переподключится
+            asyncio.ensure_future(conn.wait_closed()).add_done_callback(
+                lambda _: _forget(pool_key, conn)
+            )
+        return conn
+
+
+def _forget(pool_key, conn):
+    """Удалить закрытое соединение из пула"""
+    if _pools.get(pool_key) is conn:
+        del _pools[pool_key]
+
+
+async def create_process(host: str, port: int, user: str, key: str, command: str):
+    """
+    Запустить команду в отдельном канале общего SSH соединения
+
+    Потоки работают с bytes (encoding=None), как у asyncio subprocess
+    """
+    if asyncssh is None:
+        return await _create_ssh_subprocess(host, port, user, key, command)
+    conn = await get_conn(host, port, user, key)
+    return await conn.create_process(command, encoding=None)
+
+
+def _ssh_base_args(host: str, port: int, user: str, key: str) -> list:
+    """Аргументы ssh с мультиплексированием через ControlMaster"""
+    return [
+        'ssh',
+        '-i', key,
+        '-p', str(port),
+        '-o', 'StrictHostKeyChecking=no',
+        '-o', 'UserKnownHostsFile=/dev/null',
+        '-o', 'ControlMaster=auto',
+        '-o', f'ControlPath={SSH_CONTROL_PATH}',
+        '-o', f'ControlPersist={SSH_CONTROL_PERSIST}',
+        f'{user}@{host}'
+    ]
+
+
+async def _create_ssh_subprocess(host: str, port: int, user: str, key: str, command: str):
+    """Запустить команду через OpenSSH, переиспользуя master-соединение"""
+    # Директория под control-сокеты доступна только владельцу
+    os.makedirs(SSH_CONTROL_DIR, mode=0o700, exist_ok=True)
+    os.chmod(SSH_CONTROL_DIR, 0o700)
+    _control_targets.add((user, host, port, key))
+    
+    return await asyncio.create_subprocess_exec(
+        *_ssh_base_args(host, port, user, key),
+        command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=_json.MAX_LINE_SIZE
+    )
+
+
+async def close_process(process):
+    """Закрыть канал процесса, не трогая общее соединение"""
+    if isinstance(process, asyncio.subprocess.Process):
+        try:
+            process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=5.0)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+        return
+    
+    process.close()
+    try:
+        await asyncio.wait_for(process.wait_closed(), timeout=5.0)
+    except asyncio.TimeoutError:
+        logger.warning("Timeout closing SSH channel")
+
+
+async def close_all():
+    """Закрыть все общие SSH соединения (при завершении бота)"""
+    async with _pool_lock:
+        for (user, host, port), conn in list(_pools.items()):
+            conn.close()
+            await conn.wait_closed()
+            logger.info(f"✓ SSH connection to {user}@{host}:{port} closed")
+        _pools.clear()
+    
+    # Останавливаем OpenSSH master-соединения
+    for user, host, port, key in list(_control_targets):
+        proc = await asyncio.create_subprocess_exec(
+            *_ssh_base_args(host, port, user, key)[:-1],
+            '-O', 'exit',
+            f'{user}@{host}',
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
+        logger.info(f"✓ SSH master {user}@{host}:{port} stopped")
+    _control_targets.clear()
@@ -4,12 +4,20 @@
 MCP GitHub Client - клиент для работы с GitHub репозиториями
 """
 
-import json
+import os
+import time
 import asyncio
 import logging
+from collections import OrderedDict
+
+from . import _json
 
 logger = logging.getLogger(__name__)
 
+# Кэш ответов get_file_contents / search_code
+CACHE_MAX_SIZE = 512
+CACHE_TTL = 300  # 5 минут
+
 
 class MCPGitHubClient:
     """Клиент для взаимодействия с MCP GitHub Server"""
@@ -18,36 +26,44 @@ class MCPGitHubClient:
         self.server_path = server_path
         self.github_token = github_token
         self.process = None
-        self.lock = asyncio.Lock()
+        # Запросы мультиплексируются по JSON-RPC id: один читатель stdout
+        # раздаёт ответы по futures, lock нужен только на запись в stdin
+        self.write_lock = asyncio.Lock()
+        self._pending = {}  # request id -> Future
+        self._next_id = 0
+        self._reader_task = None
+        self._stderr_task = None
+        self._cache = OrderedDict()  # key -> (timestamp, value)
+        # get_files_batch есть не у всех GitHub MCP серверов: после первой
+        # ошибки больше не тратим на него запрос, сразу отдаём None
+        self._batch_supported = True
+        # Окружение для node: наследуем родительское (HOME, прокси, CA),
+        # переопределяем только необходимое. Собирается один раз на клиент
+        self._env = {
+            **os.environ,
+            'GITHUB_TOKEN': github_token,
+            'NODE_PATH': '/usr/local/lib/node_modules'
+        }
+        # Ограничиваем heap node, если не задано явно
+        self._env.setdefault('NODE_OPTIONS', '--max-old-space-size=256')
         
     async def start(self):
         """Запустить MCP GitHub сервер"""
         try:
             # Запускаем сервер с переменной окружения GITHUB_TOKEN
-            env = {
-                'GITHUB_TOKEN': self.github_token,
-                'PATH': '/usr/bin:/bin:/usr/local/bin:/usr/local/sbin',
-                'NODE_PATH': '/usr/local/lib/node_modules'
-            }
-            
             self.process = await asyncio.create_subprocess_exec(
                 'node', self.server_path,
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
-                env=env
+                limit=_json.MAX_LINE_SIZE,
+                env=self._env
             )
             
-            # Читаем приветствие сервера
-            if self.process.stderr:
-                try:
-                    greeting = await asyncio.wait_for(
-                        self.process.stderr.readline(),
-                        timeout=5.0
-                    )
-                    logger.info(f"MCP GitHub Server: {greeting.decode().strip()}")
-                except asyncio.TimeoutError:
-                    logger.warning("No greeting from MCP GitHub Server")
+            # stderr читаем в фоне постоянно: приветствие не задерживает старт,
+            # а многословный сервер не заблокируется на переполненном pipe
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
+            self._reader_task = asyncio.create_task(self._read_loop(self.process))
             
             logger.info("✓ MCP GitHub Server started")
             return True
@@ -55,8 +71,32 @@ class MCPGitHubClient:
             logger.error(f"Failed to start MCP GitHub Server: {e}")
             return False
     
+    async def _drain_stderr(self):
+        """Читать stderr сервера до EOF, чтобы pipe не переполнялся"""
+        # Первая строка - приветствие сервера, остальное - отладочный лог
+        try:
+            greeting = await self.process.stderr.readline()
+            if not greeting:
+                logger.warning("No greeting from MCP GitHub Server")
+                return
+            logger.info(f"MCP GitHub Server: {greeting.decode(errors='replace').strip()}")
+            
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug("MCP GitHub Server stderr: %s", line.decode(errors='replace').rstrip())
+        except Exception as e:
+            logger.warning(f"Error reading MCP GitHub Server stderr: {e}")
+    
     async def stop(self):
         """Остановить MCP GitHub сервер"""
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
         if self.process:
             try:
                 self.process.terminate()
@@ -65,6 +105,78 @@ class MCPGitHubClient:
                 self.process.kill()
                 await self.process.wait()
             logger.info("✓ MCP GitHub Server stopped")
+        self._cache.clear()
+    
+    async def _read_loop(self, process):
+        """Читать ответы сервера и передавать их ожидающим запросам по id"""
+        try:
+            while True:
+                response_line = await process.stdout.readline()
+                if not response_line:
+                    break
+                
+                # Декодируем только префикс для лога и только при DEBUG:
+                # ответ GitHub может занимать мегабайты
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received from MCP GitHub: %s...", response_line[:200].decode(errors='replace'))
+                
+                try:
+                    response = _json.loads(response_line)
+                except _json.JSONDecodeError as e:
+                    logger.warning(f"Invalid JSON from MCP GitHub Server: {e}")
+                    continue
+                
+                # Ответы на запросы, прерванные по таймауту, здесь уже никто не ждёт
+                future = self._pending.pop(response.get("id"), None)
+                if future and not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            logger.error(f"Error reading MCP GitHub Server stdout: {e}")
+        finally:
+            # Процесс завершился - ответов на ожидающие запросы уже не будет
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionResetError("MCP GitHub Server closed connection"))
+            self._pending.clear()
+    
+    async def _exchange(self, request: dict) -> dict:
+        """Отправить запрос с новым id и дождаться ответа с тем же id"""
+        self._next_id += 1
+        request_id = self._next_id
+        request["id"] = request_id
+        request_bytes = _json.dumps(request) + b'\n'
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self.write_lock:
+                self.process.stdin.write(request_bytes)
+                await self.process.stdin.drain()
+            return await asyncio.wait_for(future, timeout=30.0)
+        finally:
+            self._pending.pop(request_id, None)
+    
+    def _cache_get(self, key):
+        """Получить значение из кэша (None если нет или истёк TTL)"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        timestamp, value = entry
+        if time.monotonic() - timestamp > CACHE_TTL:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        # Отдаём копию: вызывающий код может модифицировать результат
+        return dict(value) if isinstance(value, dict) else value
+    
+    def _cache_put(self, key, value):
+        """Положить значение в кэш с вытеснением самых старых записей"""
+        if value is None:
+            return
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > CACHE_MAX_SIZE:
+            self._cache.popitem(last=False)
     
     async def call_tool(self, tool_name: str, arguments: dict) -> dict:
         """Вызвать инструмент MCP GitHub сервера"""
@@ -72,53 +184,47 @@ class MCPGitHubClient:
             logger.error("MCP GitHub Server is not running")
             return None
         
-        async with self.lock:
-            try:
-                request = {
-                    "jsonrpc": "2.0",
-                    "method": "tools/call",
-                    "params": {
-                        "name": tool_name,
-                        "arguments": arguments
-                    },
-                    "id": 1
+        try:
+            request = {
+                "jsonrpc": "2.0",
+                "method": "tools/call",
+                "params": {
+                    "name": tool_name,
+                    "arguments": arguments
                 }
-                
-                request_json = json.dumps(request) + '\n'
-                logger.info(f"Sending to MCP GitHub: {tool_name}")
-                
-                self.process.stdin.write(request_json.encode())
-                await self.process.stdin.drain()
-                
-                response_line = await asyncio.wait_for(
-                    self.process.stdout.readline(),
-                    timeout=30.0
-                )
-                
-                response_text = response_line.decode().strip()
-                logger.info(f"Received from MCP GitHub: {response_text[:200]}...")
-                
-                response = json.loads(response_text)
-                
-                if 'result' in response:
-                    content = response['result']['content'][0]['text']
-                    return json.loads(content)
-                elif 'error' in response:
-                    logger.error(f"MCP GitHub error: {response['error']}")
-                    return None
-                else:
-                    logger.error(f"Unexpected response: {response}")
-                    return None
-                    
-            except asyncio.TimeoutError:
-                logger.error("MCP GitHub timeout")
+            }
+            
+            logger.debug("Sending to MCP GitHub: %s", tool_name)
+            # Несколько запросов могут быть в полёте одновременно:
+            # ответы сопоставляются по id в _read_loop
+            response = await self._exchange(request)
+            
+            if 'result' in response:
+                content = response['result']['content'][0]['text']
+                return _json.loads(content)
+            elif 'error' in response:
+                logger.error(f"MCP GitHub error: {response['error']}")
                 return None
-            except Exception as e:
-                logger.error(f"Error calling MCP GitHub: {e}")
+            else:
+                logger.error(f"Unexpected response: {response}")
                 return None
+                
+        except asyncio.TimeoutError:
+            logger.error("MCP GitHub timeout")
+            return None
+        except Exception as e:
+            logger.error(f"Error calling MCP GitHub: {e}")
+            return None
     
     async def search_code(self, owner: str, repo: str, query: str, path: str = None) -> dict:
         """Поиск по коду в репозитории"""
+        # Нормализуем пробелы, чтобы косметические отличия попадали в один ключ
+        query = " ".join(query.split())
+        cache_key = ("search_code", owner, repo, query, path)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         # Формируем GitHub search query
         search_query = f"{query} repo:{owner}/{repo}"
     
@@ -129,10 +235,18 @@ class MCPGitHubClient:
         if path:
             arguments["path"] = path
         
-        return await self.call_tool("search_code", arguments)
+        result = await self.call_tool("search_code", arguments)
+        # В кэш - копию: вызывающий код может модифицировать результат
+        self._cache_put(cache_key, dict(result) if isinstance(result, dict) else result)
+        return result
     
     async def get_file_contents(self, owner: str, repo: str, path: str, ref: str = None) -> dict:
         """Получить содержимое файла"""
+        cache_key = ("get_file_contents", owner, repo, path, ref or "HEAD")
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         arguments = {
             "owner": owner,
             "repo": repo,
@@ -142,4 +256,54 @@ class MCPGitHubClient:
         if ref:
             arguments["ref"] = ref
         
-        return await self.call_tool("get_file_contents", arguments)
+        result = await self.call_tool("get_file_contents", arguments)
+        # В кэш - копию: вызывающий код может модифицировать результат
+        self._cache_put(cache_key, dict(result) if isinstance(result, dict) else result)
+        return result
+    
+    async def get_files(self, owner: str, repo: str, paths: list, ref: str = None) -> dict:
+        """
+        Получить содержимое нескольких файлов одним запросом
+        
+        MCP инструмент get_files_batch делает один GraphQL запрос
+        с алиасами (f0: object(expression: "HEAD:path0") ...)
+        
+        Returns:
+            dict {path: text} (отсутствующие файлы не попадают в результат)
+            или None если batch инструмент недоступен
+        """
+        ref = ref or "HEAD"
+        files = {}
+        missing = []
+        for path in paths:
+            cached = self._cache_get(("get_files", owner, repo, path, ref))
+            if cached is not None:
+                files[path] = cached
+            else:
+                missing.append(path)
+        
+        if not missing:
+            return files
+        if not self._batch_supported:
+            return None
+        
+        result = await self.call_tool("get_files_batch", {
+            "owner": owner,
+            "repo": repo,
+            "paths": missing,
+            "ref": ref
+        })
+        if result is None:
+            # Переключаемся один раз, даже если несколько запросов уже в работе
+            if self._batch_supported:
+                self._batch_supported = False
+                logger.warning("get_files_batch недоступен, файлы запрашиваются по одному")
+            return None
+        
+        for path, text in result.items():
+            if text is None:
+                continue
+            self._cache_put(("get_files", owner, repo, path, ref), text)
+            files[path] = text
+        
+        return files
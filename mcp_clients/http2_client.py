@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+MCP HTTP/2 Client - JSON-RPC транспорт поверх HTTP/2 (POST /rpc)
+
+Используется вместо stdio через SSH, если MCP сервер доступен по HTTPS:
+одно TLS соединение мультиплексирует параллельные запросы, поэтому
+lock и корреляция ответов по id не нужны
+"""
+
+import logging
+
+import httpx
+
+from . import _json
+
+try:
+    import h2  # noqa: F401 - нужен httpx для http2=True
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class MCPHttp2Client:
+    """JSON-RPC клиент MCP сервера по HTTP/2"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.rpc_url = base_url.rstrip('/') + '/rpc'
+        self.timeout = timeout
+        self._client = None
+        self._next_id = 0
+
+    async def start(self):
+        """Открыть HTTP клиент (соединение устанавливается при первом запросе)"""
+        if not HTTP2_AVAILABLE:
+            logger.warning("h2 is not installed, MCP HTTP transport falls back to HTTP/1.1 keep-alive")
+        self._client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_keepalive_connections=10),
+            timeout=self.timeout
+        )
+        logger.info(f"✓ MCP HTTP client ready: {self.rpc_url}")
+        return True
+
+    async def stop(self):
+        """Закрыть HTTP клиент"""
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, request: dict) -> dict:
+        """Отправить JSON-RPC запрос и вернуть ответ"""
+        self._next_id += 1
+        request["id"] = self._next_id
+
+        response = await self._client.post(
+            self.rpc_url,
+            content=_json.dumps(request),
+            headers={"Content-Type": "application/json"}
+        )
+        response.raise_for_status()
+        return _json.loads(response.content)
@@ -4,10 +4,12 @@
 MCP Mobile Client - клиент для работы с Android эмулятором через SSH
 """
 
-import json
 import asyncio
 import logging
 
+from . import _json
+from . import _ssh_pool
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,35 +24,22 @@ class MCPMobileClient:
         self.server_path = server_path
         self.process = None
         self.lock = asyncio.Lock()
+        self._stderr_task = None
         
     async def start(self):
         """Запустить MCP сервер через SSH"""
         try:
-            ssh_command = [
-                'ssh',
-                '-i', self.ssh_key,
-                '-p', str(self.ssh_port),
-                '-o', 'StrictHostKeyChecking=no',
-                '-o', 'UserKnownHostsFile=/dev/null',
-                f'{self.ssh_user}@{self.ssh_host}',
+            self.process = await _ssh_pool.create_process(
+                self.ssh_host,
+                self.ssh_port,
+                self.ssh_user,
+                self.ssh_key,
                 f'node {self.server_path}'
-            ]
-            
-            self.process = await asyncio.create_subprocess_exec(
-                *ssh_command,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
             )
             
-            try:
-                greeting = await asyncio.wait_for(
-                    self.process.stderr.readline(),
-                    timeout=5.0
-                )
-                logger.info(f"MCP Mobile Server: {greeting.decode().strip()}")
-            except asyncio.TimeoutError:
-                logger.warning("No greeting from MCP Mobile Server")
+            # stderr читаем в фоне постоянно: приветствие не задерживает старт,
+            # а многословный сервер не заблокируется на переполненном pipe
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
             
             logger.info("✓ MCP Mobile Server started (via SSH)")
             return True
@@ -58,15 +47,33 @@ class MCPMobileClient:
             logger.error(f"Failed to start MCP Mobile Server: {e}")
             return False
     
+    async def _drain_stderr(self):
+        """Читать stderr сервера до EOF, чтобы pipe не переполнялся"""
+        # Первая строка - приветствие сервера, остальное - отладочный лог
+        try:
+            greeting = await self.process.stderr.readline()
+            if not greeting:
+                logger.warning("No greeting from MCP Mobile Server")
+                return
+            logger.info(f"MCP Mobile Server: {greeting.decode(errors='replace').strip()}")
+            
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug("MCP Mobile Server stderr: %s", line.decode(errors='replace').rstrip())
+        except Exception as e:
+            logger.warning(f"Error reading MCP Mobile Server stderr: {e}")
+    
     async def stop(self):
         """Остановить MCP сервер"""
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
         if self.process:
-            try:
-                self.process.terminate()
-                await asyncio.wait_for(self.process.wait(), timeout=5.0)
-            except asyncio.TimeoutError:
-                self.process.kill()
-                await self.process.wait()
+            # Закрываем только канал, общее SSH соединение остаётся в пуле
+            await _ssh_pool.close_process(self.process)
+            self.process = None
             logger.info("✓ MCP Mobile Server stopped")
     
     async def call_tool(self, tool_name: str, arguments: dict) -> dict:
@@ -75,47 +82,52 @@ class MCPMobileClient:
             logger.error("MCP Mobile Server is not running")
             return None
         
-        async with self.lock:
-            try:
-                request = {
-                    "jsonrpc": "2.0",
-                    "method": "tools/call",
-                    "params": {
-                        "name": tool_name,
-                        "arguments": arguments
-                    },
-                    "id": 1
-                }
-                
-                request_json = json.dumps(request) + '\n'
-                logger.info(f"Sending to MCP Mobile: {request_json.strip()}")
-                
-                self.process.stdin.write(request_json.encode())
+        try:
+            request = {
+                "jsonrpc": "2.0",
+                "method": "tools/call",
+                "params": {
+                    "name": tool_name,
+                    "arguments": arguments
+                },
+                "id": 1
+            }
+            
+            request_bytes = _json.dumps(request) + b'\n'
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending to MCP Mobile: %s", request_bytes[:-1].decode(errors='replace'))
+            
+            # Под lock только запись и чтение строки ответа:
+            # сериализация и разбор JSON идут параллельно с другими запросами
+            async with self.lock:
+                self.process.stdin.write(request_bytes)
                 await self.process.stdin.drain()
-                
+            
                 response_line = await asyncio.wait_for(
                     self.process.stdout.readline(),
                     timeout=30.0
                 )
-                
-                response_text = response_line.decode().strip()
-                logger.info(f"Received from MCP Mobile: {response_text[:200]}...")
-                
-                response = json.loads(response_text)
-                
-                if 'result' in response:
-                    content = response['result']['content'][0]['text']
-                    return json.loads(content)
-                elif 'error' in response:
-                    logger.error(f"MCP Mobile error: {response['error']}")
-                    return None
-                else:
-                    logger.error(f"Unexpected response: {response}")
-                    return None
-                    
-            except asyncio.TimeoutError:
-                logger.error("MCP Mobile timeout")
+            
+            # Декодируем только префикс для лога и только при DEBUG:
+            # ответ может занимать мегабайты
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received from MCP Mobile: %s...", response_line[:200].decode(errors='replace'))
+            
+            response = _json.loads(response_line)
+            
+            if 'result' in response:
+                content = response['result']['content'][0]['text']
+                return _json.loads(content)
+            elif 'error' in response:
+                logger.error(f"MCP Mobile error: {response['error']}")
                 return None
-            except Exception as e:
-                logger.error(f"Error calling MCP Mobile: {e}")
+            else:
+                logger.error(f"Unexpected response: {response}")
                 return None
+                
+        except asyncio.TimeoutError:
+            logger.error("MCP Mobile timeout")
+            return None
+        except Exception as e:
+            logger.error(f"Error calling MCP Mobile: {e}")
+            return None
@@ -4,10 +4,11 @@
 MCP News Client - клиент для работы с новостным сервисом
 """
 
-import json
 import asyncio
 import logging
 
+from . import _json
+
 logger = logging.getLogger(__name__)
 
 
@@ -18,20 +19,32 @@ class MCPNewsClient:
         self.server_path = server_path
         self.process = None
         self.lock = asyncio.Lock()
+        self._stderr_task = None
+        self._supervisor = None
+        self._stopping = False
         
     async def start(self):
-        """Запустить MCP сервер"""
+        """Запустить MCP сервер и супервизор перезапуска"""
+        self._stopping = False
+        if not await self._spawn():
+            return False
+        self._supervisor = asyncio.create_task(self._supervise())
+        return True
+    
+    async def _spawn(self):
+        """Запустить процесс MCP сервера"""
         try:
             self.process = await asyncio.create_subprocess_exec(
                 'node', self.server_path,
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=_json.MAX_LINE_SIZE
             )
             
-            if self.process.stderr:
-                greeting = await self.process.stderr.readline()
-                logger.info(f"MCP News Server: {greeting.decode().strip()}")
+            # stderr читаем в фоне постоянно: приветствие не задерживает старт,
+            # а многословный сервер не заблокируется на переполненном pipe
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
             
             logger.info("✓ MCP News Server started")
             return True
@@ -39,8 +52,52 @@ class MCPNewsClient:
             logger.error(f"Failed to start MCP News Server: {e}")
             return False
     
+    async def _supervise(self):
+        """Следить за процессом и перезапускать его при падении"""
+        loop = asyncio.get_running_loop()
+        backoff = 1
+        while not self._stopping:
+            started_at = loop.time()
+            rc = await self.process.wait()
+            if self._stopping:
+                return
+            # Процесс проработал достаточно долго - сбрасываем задержку
+            if loop.time() - started_at > 60:
+                backoff = 1
+            logger.warning(f"MCP News Server exited with code {rc}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+            await self._spawn()
+            # Удваиваем после каждого перезапуска: сервер, падающий сразу
+            # после старта, не перезапускается каждую секунду
+            backoff = min(backoff * 2, 30)
+    
+    async def _drain_stderr(self):
+        """Читать stderr сервера до EOF, чтобы pipe не переполнялся"""
+        # Первая строка - приветствие сервера, остальное - отладочный лог
+        try:
+            greeting = await self.process.stderr.readline()
+            if not greeting:
+                logger.warning("No greeting from MCP News Server")
+                return
+            logger.info(f"MCP News Server: {greeting.decode(errors='replace').strip()}")
+            
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug("MCP News Server stderr: %s", line.decode(errors='replace').rstrip())
+        except Exception as e:
+            logger.warning(f"Error reading MCP News Server stderr: {e}")
+    
     async def stop(self):
         """Остановить MCP сервер"""
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        self._stopping = True
+        if self._supervisor:
+            self._supervisor.cancel()
+            self._supervisor = None
         if self.process:
             try:
                 self.process.terminate()
@@ -56,47 +113,57 @@ class MCPNewsClient:
             logger.error("MCP News Server is not running")
             return None
         
-        async with self.lock:
-            try:
-                request = {
-                    "jsonrpc": "2.0",
-                    "method": "tools/call",
-                    "params": {
-                        "name": tool_name,
-                        "arguments": arguments
-                    },
-                    "id": 1
-                }
-                
-                request_json = json.dumps(request) + '\n'
-                logger.info(f"Sending to MCP News: {request_json.strip()}")
-                
-                self.process.stdin.write(request_json.encode())
+        try:
+            request = {
+                "jsonrpc": "2.0",
+                "method": "tools/call",
+                "params": {
+                    "name": tool_name,
+                    "arguments": arguments
+                },
+                "id": 1
+            }
+            
+            request_bytes = _json.dumps(request) + b'\n'
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sending to MCP News: %s", request_bytes[:-1].decode(errors='replace'))
+            
+            # Под lock только запись и чтение строки ответа:
+            # сериализация и разбор JSON идут параллельно с другими запросами
+            async with self.lock:
+                self.process.stdin.write(request_bytes)
                 await self.process.stdin.drain()
-                
+            
                 response_line = await asyncio.wait_for(
                     self.process.stdout.readline(),
                     timeout=30.0
                 )
-                
-                response_text = response_line.decode().strip()
-                logger.info(f"Received from MCP News: {response_text[:200]}...")
-                
-                response = json.loads(response_text)
-                
-                if 'result' in response:
-                    content = response['result']['content'][0]['text']
-                    return json.loads(content)
-                elif 'error' in response:
-                    logger.error(f"MCP News error: {response['error']}")
-                    return None
-                else:
-                    logger.error(f"Unexpected response: {response}")
-                    return None
-                    
-            except asyncio.TimeoutError:
-                logger.error("MCP News timeout")
+            
+            if not response_line:
+                # Процесс завершился - супервизор его перезапустит
+                logger.error("MCP News Server closed connection")
+                return None
+            
+            # Декодируем только префикс для лога и только при DEBUG:
+            # ответ может занимать мегабайты
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received from MCP News: %s...", response_line[:200].decode(errors='replace'))
+            
+            response = _json.loads(response_line)
+            
+            if 'result' in response:
+                content = response['result']['content'][0]['text']
+                return _json.loads(content)
+            elif 'error' in response:
+                logger.error(f"MCP News error: {response['error']}")
                 return None
-            except Exception as e:
-                logger.error(f"Error calling MCP News: {e}")
+            else:
+                logger.error(f"Unexpected response: {response}")
                 return None
+                
+        except asyncio.TimeoutError:
+            logger.error("MCP News timeout")
+            return None
+        except Exception as e:
+            logger.error(f"Error calling MCP News: {e}")
+            return None
@@ -2,11 +2,73 @@
 # Optimized version with improved parameters
 
 import asyncio
+import hashlib
 import logging
 import aiohttp
 
+from ._retry import retry
+from ._circuit_breaker import CircuitBreaker
+from . import _json
+
 logger = logging.getLogger(__name__)
 
+# Built once and shared: the session default is the chat timeout,
+# the availability probe overrides it per request
+_TAGS_TIMEOUT = aiohttp.ClientTimeout(total=1)
+_CHAT_TIMEOUT = aiohttp.ClientTimeout(total=120)  # 120s timeout
+
+# Startup readiness poll: up to 10 probes, 0.25s delay doubling up to 2s
+_PROBE_ATTEMPTS = 10
+_PROBE_DELAY = 0.25
+_PROBE_DELAY_MAX = 2.0
+
+# Context window bounds (tokens): 512 .. 2048
+_NUM_CTX_MIN_BITS = 9
+_NUM_CTX_MAX = 2048
+
+# Upper bound for one NDJSON line of the streaming response
+_MAX_STREAM_LINE = 1 << 20  # 1 MiB
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Ошибки, означающие недоступность сервера: таймаут, обрыв соединения/потока.
+# Битый JSON или слишком длинная строка - ошибка ответа, а не отказ сервера
+OUTAGE_ERRORS = (asyncio.TimeoutError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+
+def _is_outage(error):
+    """Считать ли ошибку отказом сервера (таймаут, обрыв соединения, HTTP 5xx)"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(error, OUTAGE_ERRORS)
+
+
+def _context_size(messages, max_tokens):
+    """Context window for the request: prompt tokens (~bytes/3) + answer, rounded up to a power of two"""
+    prompt_bytes = sum(len(m["content"].encode()) for m in messages)
+    ctx = 1 << max(_NUM_CTX_MIN_BITS, (prompt_bytes // 3 + max_tokens).bit_length())
+    return min(ctx, _NUM_CTX_MAX)
+
+
+async def _iter_ndjson(content):
+    """Parse an NDJSON stream from whole HTTP chunks, bounding the line length"""
+    buffer = bytearray()
+    async for data, _ in content.iter_chunks():
+        buffer += data
+        while True:
+            pos = buffer.find(b"\n")
+            if pos < 0:
+                break
+            line = bytes(buffer[:pos])
+            del buffer[:pos + 1]
+            if line.strip():
+                yield _json.loads(line)
+        if len(buffer) > _MAX_STREAM_LINE:
+            raise ValueError(f"Ollama stream line exceeds {_MAX_STREAM_LINE} bytes")
+    if buffer.strip():
+        yield _json.loads(bytes(buffer))
+
+
 class OllamaLocalChatClient:
     """Client for chatting with Ollama LLM on dedicated server"""
     
@@ -14,79 +76,201 @@ class OllamaLocalChatClient:
         # Direct connection to Ollama server (no SSH tunnel)
         self.ollama_url = "http://157.22.241.102:11434"
         self.model = "llama3.2:1b"
+        # One keep-alive session for the client lifetime (created in start)
+        self._session = None
+        # Fail fast while the Ollama server is down instead of waiting 120s per message
+        self._breaker = CircuitBreaker("Ollama chat", failure_threshold=5, recovery_timeout=30.0)
+        # Bulkhead: at most 2 generations at once, the rest wait in the queue
+        self._sem = asyncio.Semaphore(2)
+        # Identical concurrent chat_full() calls share one generation: key -> Future
+        self._inflight = {}
+        # Static part of every chat payload; chat() only adds messages and per-call options
+        self._payload_template = {
+            "model": self.model,
+            "stream": True,
+            "keep_alive": "5m",                  # Модель остаётся в памяти между сообщениями
+        }
+        self._options_template = {
+            "top_p": 0.9,                        # Фокус на вероятных токенах
+            "repeat_penalty": 1.1                # Избегать повторений
+        }
+    
+    def _get_session(self):
+        """Return the shared session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=10,
+                    keepalive_timeout=75,
+                    enable_cleanup_closed=True
+                ),
+                timeout=_CHAT_TIMEOUT
+            )
+        return self._session
+    
+    @property
+    def circuit_open(self):
+        """Сервер признан недоступным: chat() сейчас ничего не вернёт"""
+        return self._breaker.is_open()
         
     async def start(self):
-        """Check Ollama server availability"""
-        try:
-            logger.info("Checking Ollama server at http://157.22.241.102:11434...")
+        """Wait until the Ollama server answers /api/tags (no fixed startup delay)"""
+        logger.info(f"Checking Ollama server at {self.ollama_url}...")
+        session = self._get_session()
+        delay = _PROBE_DELAY
         
-            # Check connection to Ollama server
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{self.ollama_url}/api/tags", timeout=aiohttp.ClientTimeout(total=10)) as resp:
+        for attempt in range(1, _PROBE_ATTEMPTS + 1):
+            try:
+                async with session.get(f"{self.ollama_url}/api/tags", timeout=_TAGS_TIMEOUT) as resp:
                     if resp.status == 200:
                         data = await resp.json()
                         models = data.get("models", [])
                         logger.info(f"✓ Ollama server available at {self.ollama_url}")
-                        logger.info(f"Available models: {[m['name'] for m in models]}")
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info("Available models: %s", [m['name'] for m in models])
                         return True
-                    else:
-                        logger.error(f"Ollama connection test failed: {resp.status}")
-                        return False
-  
-        except Exception as e:
-            logger.error(f"Failed to connect to Ollama: {e}")
-            return False
+                    logger.warning(f"Ollama connection test failed: {resp.status} (attempt {attempt})")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.debug(f"Ollama not ready (attempt {attempt}): {e}")
+            
+            if attempt < _PROBE_ATTEMPTS:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _PROBE_DELAY_MAX)
+        
+        logger.error(f"Failed to connect to Ollama after {_PROBE_ATTEMPTS} attempts")
+        return False
 
     async def chat(self, messages, temperature=0.3, max_tokens=512):
         """
-        Send chat request to Ollama with optimized parameters
+        Send streaming chat request to Ollama with optimized parameters
         
         Args:
             messages: List of {"role": "user/assistant/system", "content": "text"}
             temperature: Sampling temperature (default: 0.3 for accuracy)
             max_tokens: Max response length
             
-        Returns:
-            str: Generated response
+        Yields:
+            str: Response chunks as they are generated
+            (errors are logged and end the stream)
         """
-        try:
-            # Ollama chat API format with optimized parameters
-            payload = {
-                "model": self.model,
-                "messages": messages,
-                "stream": False,
-                "options": {
-                    "temperature": temperature,      # 0.3 - более точные ответы
-                    "num_predict": max_tokens,       # 512 tokens
-                    "num_ctx": 768,                  # Увеличен контекст (было 512)
-                    "top_p": 0.9,                    # Фокус на вероятных токенах
-                    "repeat_penalty": 1.1            # Избегать повторений
-                }
+        if not self._breaker.allow_request():
+            logger.warning("Ollama chat circuit is open, request skipped")
+            return
+        
+        # Ollama chat API format with optimized parameters
+        payload = {
+            **self._payload_template,
+            "messages": messages,
+            "options": {
+                **self._options_template,
+                "temperature": temperature,      # 0.3 - более точные ответы
+                "num_predict": max_tokens,       # 512 tokens
+                "num_ctx": _context_size(messages, max_tokens),  # По размеру диалога
             }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
+        }
+        # Serialize once (orjson when available) instead of aiohttp's json= path
+        body = _json.dumps(payload)
+        
+        # Поток читается отдельной задачей в очередь: слот bulkhead освобождается,
+        # как только Ollama закончила генерацию, а не когда медленный потребитель
+        # (редактирование сообщения в Telegram) дочитал ответ
+        queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_stream(body, queue))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            # Потребитель прервал чтение - прекращаем и генерацию
+            reader.cancel()
+    
+    async def _read_stream(self, body, queue):
+        """Прочитать NDJSON ответ /api/chat в queue; None - конец потока"""
+        try:
+            # Bulkhead: слот занят только на время чтения HTTP потока
+            async with self._sem:
+                # Повторяем только установку соединения: после первого фрагмента
+                # ответ уже отдан вызывающему коду
+                resp = await retry(lambda: self._get_session().post(
                     f"{self.ollama_url}/api/chat",
-                    json=payload,
-                    timeout=aiohttp.ClientTimeout(total=120)  # 120s timeout
-                ) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        response = data.get("message", {}).get("content", "")
-                        logger.info(f"Ollama response generated ({len(response)} chars)")
-                        return response
+                    data=body,
+                    headers=_JSON_HEADERS
+                ))
+                async with resp:
+                    # 5xx - сервер неисправен; 4xx - ошибка запроса, сервер жив
+                    if resp.status >= 500:
+                        self._breaker.record_failure()
                     else:
+                        self._breaker.record_success()
+                
+                    if resp.status != 200:
                         error_text = await resp.text()
                         logger.error(f"Ollama API error {resp.status}: {error_text}")
-                        return None
-                        
+                        return
+                
+                    # NDJSON: одна строка - один фрагмент ответа
+                    total_chars = 0
+                    async for data in _iter_ndjson(resp.content):
+                        chunk = data.get("message", {}).get("content", "")
+                        if chunk:
+                            total_chars += len(chunk)
+                            queue.put_nowait(chunk)
+                        if data.get("done"):
+                            break
+                    logger.info(f"Ollama response generated ({total_chars} chars)")
+                    
         except asyncio.TimeoutError:
+            self._breaker.record_failure()
             logger.error("Ollama request timeout (120s)")
-            return None
         except Exception as e:
+            if _is_outage(e):
+                self._breaker.record_failure()
             logger.error(f"Ollama chat error: {e}")
-            return None
+        finally:
+            queue.put_nowait(None)
+    
+    async def chat_full(self, messages, temperature=0.3, max_tokens=512):
+        """
+        Non-streaming wrapper around chat()
+        
+        Concurrent calls with the same messages and options are coalesced:
+        the first caller runs the request, the others await its result.
+        
+        Returns:
+            str: Generated response or None on error
+        """
+        key = hashlib.blake2b(
+            _json.dumps([messages, temperature, max_tokens]),
+            digest_size=16
+        ).digest()
+        
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            logger.info("Identical Ollama request in flight, waiting for its result")
+            # shield: a cancelled follower must not cancel the leader's future
+            return await asyncio.shield(inflight)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            chunks = [chunk async for chunk in self.chat(messages, temperature, max_tokens)]
+            result = "".join(chunks) or None
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._inflight[key]
     
     async def stop(self):
         """Cleanup"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
         logger.info("✓ Ollama Local Chat Client stopped")
@@ -4,18 +4,39 @@
 MCP Ollama Client - клиент для работы с RAG через Ollama
 """
 
-import json
 import asyncio
 import logging
 
+import httpx
+
+from . import _ssh_pool
+from . import _json
+from ._retry import retry, is_read_only
+from ._circuit_breaker import CircuitBreaker
+from .http2_client import MCPHttp2Client
+
 logger = logging.getLogger(__name__)
 
+# Ошибки, означающие недоступность сервера: только они открывают circuit breaker.
+# HTTP 4xx, неверные аргументы и битый JSON - проблема запроса, а не сервера
+OUTAGE_ERRORS = (asyncio.TimeoutError, OSError, httpx.TransportError)
+if _ssh_pool.asyncssh is not None:
+    OUTAGE_ERRORS += (_ssh_pool.asyncssh.Error,)
+
+
+def _is_outage(error: Exception) -> bool:
+    """Считать ли ошибку отказом сервера (таймаут, обрыв соединения, HTTP 5xx)"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, OUTAGE_ERRORS)
+
 
 class MCPOllamaClient:
     """Клиент для взаимодействия с MCP Ollama Server (RAG)"""
     
     def __init__(self, ssh_host: str, ssh_port: int, ssh_user: str, ssh_key: str, 
-                 node_path: str, server_path: str):
+                 node_path: str, server_path: str, http_url: str = None,
+                 max_concurrency: int = 2):
         self.ssh_host = ssh_host
         self.ssh_port = ssh_port
         self.ssh_user = ssh_user
@@ -23,37 +44,39 @@ class MCPOllamaClient:
         self.node_path = node_path
         self.server_path = server_path
         self.process = None
-        self.lock = asyncio.Lock()
+        # Запросы мультиплексируются по JSON-RPC id: один читатель stdout
+        # раздаёт ответы по futures, lock нужен только на запись в stdin
+        self.write_lock = asyncio.Lock()
+        self._pending = {}  # request id -> Future
+        self._next_id = 0
+        self._reader_task = None
+        # Быстрый отказ, пока удалённый RAG/LLM недоступен
+        self._breaker = CircuitBreaker("MCP Ollama", failure_threshold=5, recovery_timeout=30.0)
+        # Bulkhead: медленные RAG вызовы не занимают больше max_concurrency слотов
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._stderr_task = None
+        # HTTP/2 транспорт, если сервер доступен по HTTPS (иначе stdio через SSH)
+        self._http = MCPHttp2Client(http_url, timeout=60.0) if http_url else None
         
     async def start(self):
         """Запустить MCP сервер через SSH"""
+        if self._http:
+            return await self._http.start()
+        
         try:
             # ВАЖНО: Устанавливаем VECTOR_STORE_DIR перед запуском node
-            ssh_command = [
-                'ssh',
-                '-i', self.ssh_key,
-                '-p', str(self.ssh_port),
-                '-o', 'StrictHostKeyChecking=no',
-                '-o', 'UserKnownHostsFile=/dev/null',
-                f'{self.ssh_user}@{self.ssh_host}',
+            self.process = await _ssh_pool.create_process(
+                self.ssh_host,
+                self.ssh_port,
+                self.ssh_user,
+                self.ssh_key,
                 f'VECTOR_STORE_DIR=/Users/{self.ssh_user}/vector_stores {self.node_path} {self.server_path}'
-            ]
-            
-            self.process = await asyncio.create_subprocess_exec(
-                *ssh_command,
-                stdin=asyncio.subprocess.PIPE,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
             )
             
-            try:
-                greeting = await asyncio.wait_for(
-                    self.process.stderr.readline(),
-                    timeout=5.0
-                )
-                logger.info(f"MCP Ollama Server: {greeting.decode().strip()}")
-            except asyncio.TimeoutError:
-                logger.warning("No greeting from MCP Ollama Server")
+            # stderr читаем в фоне постоянно: приветствие не задерживает старт,
+            # а многословный сервер не заблокируется на переполненном pipe
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
+            self._reader_task = asyncio.create_task(self._read_loop(self.process))
             
             logger.info("✓ MCP Ollama Server started (via SSH)")
             return True
@@ -61,64 +84,141 @@ class MCPOllamaClient:
             logger.error(f"Failed to start MCP Ollama Server: {e}")
             return False
     
+    async def _drain_stderr(self):
+        """Читать stderr сервера до EOF, чтобы pipe не переполнялся"""
+        # Первая строка - приветствие сервера, остальное - отладочный лог
+        try:
+            greeting = await self.process.stderr.readline()
+            if not greeting:
+                logger.warning("No greeting from MCP Ollama Server")
+                return
+            logger.info(f"MCP Ollama Server: {greeting.decode(errors='replace').strip()}")
+            
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug("MCP Ollama Server stderr: %s", line.decode(errors='replace').rstrip())
+        except Exception as e:
+            logger.warning(f"Error reading MCP Ollama Server stderr: {e}")
+    
     async def stop(self):
         """Остановить MCP сервер"""
+        if self._http:
+            await self._http.stop()
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
         if self.process:
-            try:
-                self.process.terminate()
-                await asyncio.wait_for(self.process.wait(), timeout=5.0)
-            except asyncio.TimeoutError:
-                self.process.kill()
-                await self.process.wait()
+            # Закрываем только канал, общее SSH соединение остаётся в пуле
+            await _ssh_pool.close_process(self.process)
+            self.process = None
             logger.info("✓ MCP Ollama Server stopped")
     
+    async def _read_loop(self, process):
+        """Читать ответы сервера и передавать их ожидающим запросам по id"""
+        try:
+            while True:
+                response_line = await process.stdout.readline()
+                if not response_line:
+                    break
+                
+                # Декодируем только префикс для лога и только при DEBUG
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received from MCP Ollama: %s...", response_line[:200].decode(errors='replace'))
+                
+                try:
+                    response = _json.loads(response_line)
+                except _json.JSONDecodeError as e:
+                    logger.warning(f"Invalid JSON from MCP Ollama Server: {e}")
+                    continue
+                
+                future = self._pending.pop(response.get("id"), None)
+                if future and not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            logger.error(f"Error reading MCP Ollama Server stdout: {e}")
+        finally:
+            # Процесс завершился - ответов на ожидающие запросы уже не будет
+            self._fail_pending(ConnectionResetError("MCP Ollama Server closed connection"))
+    
+    def _fail_pending(self, exc):
+        """Завершить ошибкой все ожидающие запросы"""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+    
+    async def _exchange(self, request: dict) -> dict:
+        """Отправить запрос с новым id и дождаться ответа с тем же id"""
+        if self._http:
+            return await self._http.request(request)
+        
+        self._next_id += 1
+        request_id = self._next_id
+        request["id"] = request_id
+        request_bytes = _json.dumps(request) + b'\n'
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending to MCP Ollama: %s", request_bytes[:-1].decode(errors='replace'))
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self.write_lock:
+                self.process.stdin.write(request_bytes)
+                await self.process.stdin.drain()
+            return await asyncio.wait_for(future, timeout=60.0)
+        finally:
+            self._pending.pop(request_id, None)
+    
     async def call_tool(self, tool_name: str, arguments: dict) -> dict:
         """Вызвать инструмент MCP сервера"""
-        if not self.process:
+        if not self.process and not self._http:
             logger.error("MCP Ollama Server is not running")
             return None
         
-        async with self.lock:
-            try:
-                request = {
-                    "jsonrpc": "2.0",
-                    "method": "tools/call",
-                    "params": {
-                        "name": tool_name,
-                        "arguments": arguments
-                    },
-                    "id": 1
+        if not self._breaker.allow_request():
+            logger.warning("MCP Ollama circuit is open, request skipped")
+            return None
+        
+        try:
+            request = {
+                "jsonrpc": "2.0",
+                "method": "tools/call",
+                "params": {
+                    "name": tool_name,
+                    "arguments": arguments
                 }
-                
-                request_json = json.dumps(request) + '\n'
-                logger.info(f"Sending to MCP Ollama: {request_json.strip()}")
-                
-                self.process.stdin.write(request_json.encode())
-                await self.process.stdin.drain()
-                
-                response_line = await asyncio.wait_for(
-                    self.process.stdout.readline(),
-                    timeout=60.0  # RAG может занять больше времени
+            }
+            
+            # Повторяем при таймауте/обрыве соединения (каждая попытка - новый id),
+            # но только вызовы на чтение: chunk_and_embed/vector_store_save - один раз
+            async with self._sem:
+                response = await retry(
+                    lambda: self._exchange(request), idempotent=is_read_only(tool_name)
                 )
-                
-                response_text = response_line.decode().strip()
-                logger.info(f"Received from MCP Ollama: {response_text[:200]}...")
-                
-                response = json.loads(response_text)
-                
-                if 'result' in response:
-                    content = response['result']['content'][0]['text']
-                    return json.loads(content)
-                elif 'error' in response:
-                    logger.error(f"MCP Ollama error: {response['error']}")
-                    return None
-                else:
-                    logger.error(f"Unexpected response: {response}")
-                    return None
-                    
-            except asyncio.TimeoutError:
-                logger.error("MCP Ollama timeout")
+            # Сервер ответил (даже ошибкой MCP) - он доступен
+            self._breaker.record_success()
+            
+            if 'result' in response:
+                content = response['result']['content'][0]['text']
+                return _json.loads(content)
+            elif 'error' in response:
+                logger.error(f"MCP Ollama error: {response['error']}")
                 return None
-            except Exception as e:
-                logger.error(f"Error calling MCP Ollama: {e}")
+            else:
+                logger.error(f"Unexpected response: {response}")
                 return None
+                
+        except asyncio.TimeoutError:
+            self._breaker.record_failure()
+            logger.error("MCP Ollama timeout")
+            return None
+        except Exception as e:
+            if _is_outage(e):
+                self._breaker.record_failure()
+            logger.error(f"Error calling MCP Ollama: {e}")
+            return None
@@ -1,72 +1,170 @@
 import asyncio
-import json
 import logging
 import subprocess
 from config import MCP_TASK_NODE_PATH, MCP_TASK_SERVER_PATH
+from ._retry import retry, is_read_only
+from .http2_client import MCPHttp2Client
+from . import _json
 
 logger = logging.getLogger(__name__)
 
 class TaskMCPClient:
-    def __init__(self):
+    def __init__(self, http_url=None):
         self.process = None
         self.reader = None
         self.writer = None
         self.request_id = 0
+        # Запросы мультиплексируются по JSON-RPC id: один читатель stdout
+        # раздаёт ответы по futures, lock нужен только на запись в stdin
+        self.write_lock = asyncio.Lock()
+        self._pending = {}  # request id -> Future
+        self._reader_task = None
+        self._stderr_task = None
+        # Bulkhead: собственный лимит параллельных запросов к серверу задач
+        self._sem = asyncio.Semaphore(8)
+        # HTTP/2 транспорт, если сервер доступен по HTTPS (иначе stdio)
+        self._http = MCPHttp2Client(http_url, timeout=30.0) if http_url else None
 
     async def start(self):
+        if self._http:
+            return await self._http.start()
         try:
             self.process = await asyncio.create_subprocess_exec(
                 MCP_TASK_NODE_PATH,
                 MCP_TASK_SERVER_PATH,
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=_json.MAX_LINE_SIZE
             )
             self.reader = self.process.stdout
             self.writer = self.process.stdin
             
-            stderr_line = await asyncio.wait_for(self.process.stderr.readline(), timeout=5)
-            logger.info(f"MCP Task Server: {stderr_line.decode().strip()}")
+            # stderr читаем в фоне постоянно: приветствие не задерживает старт,
+            # а многословный сервер не заблокируется на переполненном pipe
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
+            self._reader_task = asyncio.create_task(self._read_loop(self.process))
+            
             logger.info("✓ MCP Task Server started")
             return True
         except Exception as e:
             logger.error(f"Failed to start Task MCP Server: {e}")
             return False
 
+    async def _drain_stderr(self):
+        # Первая строка - приветствие сервера, остальное - отладочный лог
+        try:
+            greeting = await self.process.stderr.readline()
+            if not greeting:
+                logger.warning("No greeting from MCP Task Server")
+                return
+            logger.info(f"MCP Task Server: {greeting.decode(errors='replace').strip()}")
+
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug("MCP Task Server stderr: %s", line.decode(errors='replace').rstrip())
+        except Exception as e:
+            logger.warning(f"Error reading MCP Task Server stderr: {e}")
+
     async def stop(self):
+        if self._http:
+            await self._http.stop()
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
         if self.process:
             self.process.terminate()
             await self.process.wait()
 
+    async def _read_loop(self, process):
+        # Единственный читатель stdout: ответы раздаются ожидающим запросам по id
+        try:
+            while True:
+                response_line = await process.stdout.readline()
+                if not response_line:
+                    break
+                try:
+                    response = _json.loads(response_line)
+                except _json.JSONDecodeError as e:
+                    logger.warning(f"Invalid JSON from Task MCP Server: {e}")
+                    continue
+                # Запоздавшие ответы на повторённые запросы здесь уже никто не ждёт
+                future = self._pending.pop(response.get("id"), None)
+                if future and not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            logger.error(f"Error reading Task MCP Server stdout: {e}")
+        finally:
+            # Процесс завершился - ответов на ожидающие запросы уже не будет
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionResetError("Task MCP Server closed connection"))
+            self._pending.clear()
+
+    async def _exchange(self, request):
+        # Каждая попытка - новый id, ответ приходит через _read_loop
+        request_id = self.request_id = self.request_id + 1
+        request["id"] = request_id
+        request_bytes = _json.dumps(request)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self.write_lock:
+                # Перевод строки пишем отдельно, чтобы не копировать запрос; drain один
+                self.writer.write(request_bytes)
+                self.writer.write(b"\n")
+                await self.writer.drain()
+            return await asyncio.wait_for(future, timeout=30.0)
+        finally:
+            self._pending.pop(request_id, None)
+
     async def call_tool(self, tool_name, arguments=None):
+        if self._http:
+            async with self._sem:
+                response = await retry(lambda: self._http.request({
+                    "jsonrpc": "2.0",
+                    "method": "tools/call",
+                    "params": {
+                        "name": tool_name,
+                        "arguments": arguments or {}
+                    }
+                }), idempotent=is_read_only(tool_name))
+            return self._unwrap(response)
+        
         if not self.writer or not self.reader:
             raise RuntimeError("Task MCP client not started")
         
-        self.request_id += 1
         request = {
             "jsonrpc": "2.0",
             "method": "tools/call",
             "params": {
                 "name": tool_name,
                 "arguments": arguments or {}
-            },
-            "id": self.request_id
+            }
         }
         
-        request_json = json.dumps(request) + "\n"
-        self.writer.write(request_json.encode())
-        await self.writer.drain()
-        
-        response_line = await self.reader.readline()
-        response = json.loads(response_line.decode())
-        
+        # Семафор ограничивает число запросов в полёте, id назначает _exchange
+        async with self._sem:
+            response = await retry(
+                lambda: self._exchange(request),
+                idempotent=is_read_only(tool_name)
+            )
+        return self._unwrap(response)
+
+    def _unwrap(self, response):
         if "error" in response:
             raise RuntimeError(f"MCP error: {response['error']}")
         
         result = response.get("result", {})
         content = result.get("content", [])
         if content and content[0].get("type") == "text":
-            return json.loads(content[0]["text"])
+            return _json.loads(content[0]["text"])
         return result
 
     async def get_tasks(self, status=None, priority=None, assignee=None, tag=None):
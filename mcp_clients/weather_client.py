@@ -4,12 +4,22 @@
 MCP Weather Client - клиент для работы с погодным сервисом
 """
 
-import json
+import time
 import asyncio
 import logging
+from collections import OrderedDict
+
+from ._retry import retry
+from . import _json
 
 logger = logging.getLogger(__name__)
 
+# Кэш ответов: погода меняется за минуты, одинаковые запросы отдаём локально
+CACHE_MAX_SIZE = 256
+CACHE_TTL = 300  # 5 минут
+# Если сервер недоступен - отдаём устаревший ответ не старше часа
+CACHE_STALE_TTL = 3600
+
 
 class MCPWeatherClient:
     """Клиент для взаимодействия с MCP Weather Server"""
@@ -17,22 +27,42 @@ class MCPWeatherClient:
     def __init__(self, server_path: str):
         self.server_path = server_path
         self.process = None
-        self.lock = asyncio.Lock()
+        # Запросы мультиплексируются по JSON-RPC id: один читатель stdout
+        # раздаёт ответы по futures, lock нужен только на запись в stdin
+        self.write_lock = asyncio.Lock()
+        self._pending = {}  # request id -> Future
+        self._next_id = 0
+        self._reader_task = None
+        # Bulkhead: собственный лимит параллельных запросов к погодному серверу
+        self._sem = asyncio.Semaphore(8)
+        self._stderr_task = None
+        self._supervisor = None
+        self._stopping = False
+        self._cache = OrderedDict()  # key -> (timestamp, value)
         
     async def start(self):
-        """Запустить MCP сервер"""
+        """Запустить MCP сервер и супервизор перезапуска"""
+        self._stopping = False
+        if not await self._spawn():
+            return False
+        self._supervisor = asyncio.create_task(self._supervise())
+        return True
+    
+    async def _spawn(self):
+        """Запустить процесс MCP сервера"""
         try:
             self.process = await asyncio.create_subprocess_exec(
                 'node', self.server_path,
                 stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.PIPE,
+                limit=_json.MAX_LINE_SIZE
             )
             
-            # Читаем первую строку из stderr (приветствие сервера)
-            if self.process.stderr:
-                greeting = await self.process.stderr.readline()
-                logger.info(f"MCP Server: {greeting.decode().strip()}")
+            # stderr читаем в фоне постоянно: приветствие не задерживает старт,
+            # а многословный сервер не заблокируется на переполненном pipe
+            self._stderr_task = asyncio.create_task(self._drain_stderr())
+            self._reader_task = asyncio.create_task(self._read_loop(self.process))
             
             logger.info("✓ MCP Weather Server started")
             return True
@@ -40,8 +70,55 @@ class MCPWeatherClient:
             logger.error(f"Failed to start MCP Weather Server: {e}")
             return False
     
+    async def _supervise(self):
+        """Следить за процессом и перезапускать его при падении"""
+        loop = asyncio.get_running_loop()
+        backoff = 1
+        while not self._stopping:
+            started_at = loop.time()
+            rc = await self.process.wait()
+            if self._stopping:
+                return
+            # Процесс проработал достаточно долго - сбрасываем задержку
+            if loop.time() - started_at > 60:
+                backoff = 1
+            logger.warning(f"MCP Weather Server exited with code {rc}, restarting in {backoff}s")
+            await asyncio.sleep(backoff)
+            await self._spawn()
+            # Удваиваем после каждого перезапуска: сервер, падающий сразу
+            # после старта, не перезапускается каждую секунду
+            backoff = min(backoff * 2, 30)
+    
+    async def _drain_stderr(self):
+        """Читать stderr сервера до EOF, чтобы pipe не переполнялся"""
+        # Первая строка - приветствие сервера, остальное - отладочный лог
+        try:
+            greeting = await self.process.stderr.readline()
+            if not greeting:
+                logger.warning("No greeting from MCP Weather Server")
+                return
+            logger.info(f"MCP Server: {greeting.decode(errors='replace').strip()}")
+            
+            while True:
+                line = await self.process.stderr.readline()
+                if not line:
+                    break
+                logger.debug("MCP Weather Server stderr: %s", line.decode(errors='replace').rstrip())
+        except Exception as e:
+            logger.warning(f"Error reading MCP Weather Server stderr: {e}")
+    
     async def stop(self):
         """Остановить MCP сервер"""
+        if self._stderr_task:
+            self._stderr_task.cancel()
+            self._stderr_task = None
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._stopping = True
+        if self._supervisor:
+            self._supervisor.cancel()
+            self._supervisor = None
         if self.process:
             try:
                 self.process.terminate()
@@ -50,54 +127,136 @@ class MCPWeatherClient:
                 self.process.kill()
                 await self.process.wait()
             logger.info("✓ MCP Weather Server stopped")
+        self._cache.clear()
+    
+    async def _read_loop(self, process):
+        """Читать ответы сервера и передавать их ожидающим запросам по id"""
+        try:
+            while True:
+                response_line = await process.stdout.readline()
+                if not response_line:
+                    break
+                
+                # Декодируем только префикс для лога и только при DEBUG
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Received from MCP: %s...", response_line[:200].decode(errors='replace'))
+                
+                try:
+                    response = _json.loads(response_line)
+                except _json.JSONDecodeError as e:
+                    logger.warning(f"Invalid JSON from MCP Weather Server: {e}")
+                    continue
+                
+                future = self._pending.pop(response.get("id"), None)
+                if future and not future.done():
+                    future.set_result(response)
+        except Exception as e:
+            logger.error(f"Error reading MCP Weather Server stdout: {e}")
+        finally:
+            # Процесс завершился - ответов на ожидающие запросы уже не будет
+            self._fail_pending(ConnectionResetError("MCP Weather Server closed connection"))
+    
+    def _fail_pending(self, exc):
+        """Завершить ошибкой все ожидающие запросы"""
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+    
+    async def _exchange(self, request: dict) -> dict:
+        """Отправить запрос с новым id и дождаться ответа с тем же id"""
+        self._next_id += 1
+        request_id = self._next_id
+        request["id"] = request_id
+        request_bytes = _json.dumps(request) + b'\n'
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sending to MCP: %s", request_bytes[:-1].decode(errors='replace'))
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            async with self.write_lock:
+                self.process.stdin.write(request_bytes)
+                await self.process.stdin.drain()
+            return await asyncio.wait_for(future, timeout=10.0)
+        finally:
+            self._pending.pop(request_id, None)
+    
+    def _cache_get(self, key, max_age):
+        """Получить значение из кэша не старше max_age секунд"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        timestamp, value = entry
+        if time.monotonic() - timestamp > max_age:
+            # Просроченную по CACHE_TTL запись оставляем как запасную до CACHE_STALE_TTL
+            if max_age >= CACHE_STALE_TTL:
+                del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        # Отдаём копию: вызывающий код может модифицировать результат
+        return dict(value) if isinstance(value, dict) else value
+    
+    def _cache_put(self, key, value):
+        """Положить значение в кэш с вытеснением самых старых записей"""
+        if value is None:
+            return
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > CACHE_MAX_SIZE:
+            self._cache.popitem(last=False)
     
     async def call_tool(self, tool_name: str, arguments: dict) -> dict:
-        """Вызвать инструмент MCP сервера"""
+        """Вызвать инструмент MCP сервера (с кэшем одинаковых запросов)"""
+        # Аргументы сортируются по ключу: порядок в dict не должен плодить записи
+        cache_key = _json.dumps([tool_name, sorted((arguments or {}).items())])
+        cached = self._cache_get(cache_key, CACHE_TTL)
+        if cached is not None:
+            return cached
+        
+        result = await self._call_tool(tool_name, arguments)
+        if result is None:
+            stale = self._cache_get(cache_key, CACHE_STALE_TTL)
+            if stale is not None:
+                logger.warning(f"MCP Weather unavailable, serving cached {tool_name} result")
+            return stale
+        
+        self._cache_put(cache_key, result)
+        return result
+    
+    async def _call_tool(self, tool_name: str, arguments: dict) -> dict:
+        """Выполнить запрос к MCP серверу без кэша"""
         if not self.process:
             logger.error("MCP Weather Server is not running")
             return None
         
-        async with self.lock:
-            try:
-                request = {
-                    "jsonrpc": "2.0",
-                    "method": "tools/call",
-                    "params": {
-                        "name": tool_name,
-                        "arguments": arguments
-                    },
-                    "id": 1
+        try:
+            request = {
+                "jsonrpc": "2.0",
+                "method": "tools/call",
+                "params": {
+                    "name": tool_name,
+                    "arguments": arguments
                 }
-                
-                request_json = json.dumps(request) + '\n'
-                logger.info(f"Sending to MCP: {request_json.strip()}")
-                
-                self.process.stdin.write(request_json.encode())
-                await self.process.stdin.drain()
-                
-                response_line = await asyncio.wait_for(
-                    self.process.stdout.readline(),
-                    timeout=10.0
-                )
-                
-                response_text = response_line.decode().strip()
-                logger.info(f"Received from MCP: {response_text[:200]}...")
-                
-                response = json.loads(response_text)
-                
-                if 'result' in response:
-                    content = response['result']['content'][0]['text']
-                    return json.loads(content)
-                elif 'error' in response:
-                    logger.error(f"MCP tool call error: {response['error']}")
-                    return None
-                else:
-                    logger.error(f"Unexpected MCP response format: {response}")
-                    return None
-                    
-            except asyncio.TimeoutError:
-                logger.error("MCP tool call timeout")
+            }
+            
+            # Повторяем при таймауте/обрыве соединения (каждая попытка - новый id)
+            async with self._sem:
+                response = await retry(lambda: self._exchange(request))
+            
+            if 'result' in response:
+                content = response['result']['content'][0]['text']
+                return _json.loads(content)
+            elif 'error' in response:
+                logger.error(f"MCP tool call error: {response['error']}")
                 return None
-            except Exception as e:
-                logger.error(f"Error calling MCP tool: {e}")
+            else:
+                logger.error(f"Unexpected MCP response format: {response}")
                 return None
+                
+        except asyncio.TimeoutError:
+            logger.error("MCP tool call timeout")
+            return None
+        except Exception as e:
+            logger.error(f"Error calling MCP tool: {e}")
+            return None
@@ -1,6 +1,7 @@
 import asyncio
 import sys
 import os
+from itertools import islice
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
@@ -14,6 +15,41 @@ from config import (
     MCP_OLLAMA_SERVER_PATH
 )
 
+# Сколько запросов chunk_and_embed держать в работе одновременно
+EMBED_CONCURRENCY = 4
+# Сколько Q&A блоков склеивать в один текст для chunk_and_embed
+BLOCKS_PER_BATCH = 5
+# Сколько таких текстов отправлять одним вызовом chunk_and_embed_batch
+TEXTS_PER_CALL = 20
+
+
+def iter_blocks(path):
+    """Читать FAQ построчно и отдавать блоки, разделённые пустыми строками"""
+    buf = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                buf.append(line)
+                continue
+            block = ''.join(buf).strip()
+            buf = []
+            if len(block) > 50:
+                yield block
+    block = ''.join(buf).strip()
+    if len(block) > 50:
+        yield block
+
+
+def _chunked(iterable, size):
+    """Разбить итератор на списки по size элементов"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 async def rebuild():
     """Пересоздать хранилище с нуля"""
     
@@ -24,45 +60,72 @@ async def rebuild():
         ssh_user=MCP_OLLAMA_SSH_USER,
         ssh_key=MCP_OLLAMA_SSH_KEY,
         node_path=MCP_OLLAMA_NODE_PATH,
-        server_path=MCP_OLLAMA_SERVER_PATH
+        server_path=MCP_OLLAMA_SERVER_PATH,
+        max_concurrency=EMBED_CONCURRENCY
     )
     await client.start()
     
-    print("🔄 Читаю FAQ файл...")
-    with open('support_faq.txt', 'r', encoding='utf-8') as f:
-        faq_text = f.read()
-    
-    # Разбиваем на простые вопрос-ответ блоки
-    print("✂️ Разбиваю FAQ на Q&A пары...")
-    
-    # Простое разбиение по двойному переводу строки
-    blocks = [b.strip() for b in faq_text.split('\n\n') if b.strip() and len(b.strip()) > 50]
-    
-    print(f"📄 Создано {len(blocks)} блоков")
-    
-    # Создаём один большой chunk_and_embed для всего FAQ
-    # но с меньшими чанками
+    # Файл читается потоково: в памяти только батчи, которые сейчас в работе
+    print("🔄 Читаю FAQ файл и разбиваю на Q&A пары...")
     print("🧠 Создаю эмбеддинги...")
     
-    all_chunks_data = []
+    # Тексты по BLOCKS_PER_BATCH блоков отправляем пачками по TEXTS_PER_CALL
+    # в chunk_and_embed_batch, до EMBED_CONCURRENCY пачек параллельно.
+    # Если сервер не поддерживает batch - по одному тексту через chunk_and_embed
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+    use_batch = True
+    done = 0
     
-    # Обрабатываем по 5 блоков за раз
-    for i in range(0, len(blocks), 5):
-        batch = blocks[i:i+5]
-        batch_text = "\n\n---\n\n".join(batch)
-        
-        print(f"  📝 Batch {i//5 + 1}/{(len(blocks)-1)//5 + 1}...", end='\r')
-        
+    async def embed_text(text):
         # Используем rag_answer напрямую для создания эмбеддингов
         # Это более надёжный способ
         result = await client.call_tool("chunk_and_embed", {
-            "text": batch_text,
+            "text": text,
             "chunk_size": 800,
             "chunk_overlap": 50
         })
-        
-        if result and 'chunks' in result:
-            all_chunks_data.extend(result['chunks'])
+        return result['chunks'] if result and 'chunks' in result else []
+    
+    async def embed_group(texts):
+        nonlocal use_batch, done
+        try:
+            chunks = None
+            if use_batch:
+                result = await client.call_tool("chunk_and_embed_batch", {
+                    "texts": texts,
+                    "chunk_size": 800,
+                    "chunk_overlap": 50
+                })
+                if result and 'chunks' in result:
+                    chunks = result['chunks']
+                elif use_batch:
+                    # Переключаемся один раз, даже если несколько пачек уже в работе
+                    use_batch = False
+                    print("\n⚠️ chunk_and_embed_batch недоступен, обрабатываю по одному тексту")
+            if chunks is None:
+                results = await asyncio.gather(*(embed_text(t) for t in texts))
+                chunks = [chunk for text_chunks in results for chunk in text_chunks]
+        finally:
+            semaphore.release()
+        done += len(texts)
+        print(f"  📝 Batch {done}...", end='\r')
+        return chunks
+    
+    tasks = []
+    block_count = 0
+    batches = _chunked(iter_blocks('support_faq.txt'), BLOCKS_PER_BATCH)
+    for group in _chunked(batches, TEXTS_PER_CALL):
+        # Не читаем файл дальше, пока все слоты заняты
+        await semaphore.acquire()
+        block_count += sum(len(batch) for batch in group)
+        texts = ["\n\n---\n\n".join(batch) for batch in group]
+        tasks.append(asyncio.create_task(embed_group(texts)))
+    
+    print(f"\n📄 Прочитано {block_count} блоков")
+    
+    # gather возвращает результаты в порядке батчей - порядок чанков сохраняется
+    results = await asyncio.gather(*tasks)
+    all_chunks_data = [chunk for chunks in results for chunk in chunks]
     
     print(f"\n✅ Создано {len(all_chunks_data)} эмбеддингов")
     
@@ -3,10 +3,12 @@
 """
 
 from .rag_functions import get_rag_answer, set_ollama_client
-from .helpers import send_long_message
+from .helpers import send_long_message, send_streaming_message, get_anthropic_client
 
 __all__ = [
     'get_rag_answer',
     'set_ollama_client',
-    'send_long_message'
+    'send_long_message',
+    'send_streaming_message',
+    'get_anthropic_client'
 ]
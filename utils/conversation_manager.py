@@ -5,20 +5,202 @@ Conversation Manager - управление историей диалогов
 """
 
 import os
+import re
 import json
 import logging
+import functools
+from collections import OrderedDict
 from datetime import datetime
 from config import CONVERSATIONS_DIR
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 MAX_HISTORY_SIZE = 10 * 1024 * 1024  # 10 MB
 MAX_MESSAGES = 30
 
+# save_conversation_history пишет служебные поля до messages:
+# для статистики достаточно начала файла
+_HEADER_READ_SIZE = 512
+_MESSAGE_COUNT_RE = re.compile(rb'"message_count":\s*(\d+)')
+_LAST_UPDATED_RE = re.compile(rb'"last_updated":\s*"([^"]+)"')
+
+
+# Пользователи, чья история сжата в памяти: следующее сохранение
+# переписывает файл целиком вместо дозаписи
+_rewrite_pending = set()
 
+# Пути к файлам пользователя не меняются - строим один раз
+PATH_CACHE_SIZE = 4096
+_CONVERSATIONS_DIR = os.fspath(CONVERSATIONS_DIR)
+
+# Загруженные истории: user_id -> (mtime_ns файла сообщений, messages), LRU
+HISTORY_CACHE_SIZE = 256
+_history_cache = OrderedDict()
+
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
 def get_conversation_file_path(user_id):
-    """Получить путь к файлу истории диалога"""
-    return os.path.join(CONVERSATIONS_DIR, f"user_{user_id}.json")
+    """Получить путь к файлу истории диалога в старом формате (один JSON)"""
+    return os.path.join(_CONVERSATIONS_DIR, f"user_{user_id}.json")
+
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _messages_path(user_id):
+    """Сообщения: одно JSON сообщение на строку, только дозапись"""
+    return os.path.join(_CONVERSATIONS_DIR, f"user_{user_id}.ndjson")
+
+
+@functools.lru_cache(maxsize=PATH_CACHE_SIZE)
+def _meta_path(user_id):
+    """Служебные поля истории (last_updated, message_count)"""
+    return os.path.join(_CONVERSATIONS_DIR, f"user_{user_id}.meta.json")
+
+
+def _write_atomic(path, data: bytes):
+    """Записать файл целиком через временный файл и os.replace"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _read_meta(user_id):
+    """Прочитать служебные поля (None если файла нет)"""
+    try:
+        with open(_meta_path(user_id), 'rb') as f:
+            return _json_loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def _count_stored_messages(user_id):
+    """
+    Число сообщений в NDJSON файле (None если файла нет или последняя строка
+    оборвана - тогда файл нужно переписать целиком)
+
+    Считается по самому файлу, а не по message_count из .meta.json: после
+    сбоя между дозаписью и обновлением meta счётчик отстаёт от файла
+    """
+    messages_path = _messages_path(user_id)
+    try:
+        mtime = os.stat(messages_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    
+    cached = _history_cache.get(user_id)
+    if cached is not None and cached[0] == mtime:
+        return len(cached[1])
+    
+    with open(messages_path, 'rb') as f:
+        count = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1 << 16), b""))
+        if f.tell():
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                return None
+    return count
+
+
+def _iter_ndjson_messages(file_path):
+    """Отдавать сообщения из NDJSON файла построчно"""
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield _json_loads(line)
+
+
+def _json_dumps(data) -> bytes:
+    """Сериализовать с отступами в UTF-8 bytes (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')
+
+
+def _json_dumps_line(data) -> bytes:
+    """Сериализовать в одну строку NDJSON"""
+    if orjson is not None:
+        return orjson.dumps(data) + b"\n"
+    return json.dumps(data, ensure_ascii=False).encode('utf-8') + b"\n"
+
+
+def _json_loads(data):
+    """Разобрать JSON из bytes/str (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _iter_messages(file_path):
+    """
+    Отдавать сообщения из файла истории старого формата по одному
+    С ijson файл разбирается потоково: в памяти только текущее сообщение
+    """
+    if ijson is None:
+        with open(file_path, 'rb') as f:
+            yield from _json_loads(f.read()).get("messages", [])
+        return
+    
+    with open(file_path, 'rb') as f:
+        yield from ijson.items(f, 'messages.item')
+
+
+def _read_header(file_path):
+    """Прочитать поля перед списком messages, не разбирая сами сообщения"""
+    with open(file_path, 'rb') as f:
+        head = f.read(_HEADER_READ_SIZE)
+    count_match = _MESSAGE_COUNT_RE.search(head)
+    updated_match = _LAST_UPDATED_RE.search(head)
+    if count_match and updated_match:
+        return {
+            "message_count": int(count_match.group(1)),
+            "last_updated": updated_match.group(1).decode()
+        }
+    
+    # Нестандартный файл - разбираем честно
+    if ijson is None:
+        with open(file_path, 'rb') as f:
+            return _json_loads(f.read())
+    
+    header = {}
+    with open(file_path, 'rb') as f:
+        for prefix, event, value in ijson.parse(f):
+            if prefix == 'messages':
+                # save_conversation_history пишет messages последним полем
+                break
+            if prefix in ('message_count', 'last_updated'):
+                header[prefix] = value
+    return header
+
+
+def _convert_legacy_message(msg):
+    """Старый формат хранил ответ ассистента JSON строкой с ai_message"""
+    content = msg.get("content") if "role" in msg else None
+    if isinstance(content, str) and content.startswith("{"):
+        try:
+            parsed = _json_loads(content)
+            if "ai_message" in parsed:
+                return {"role": msg["role"], "content": parsed["ai_message"]}
+        except:
+            pass
+    return msg
+
+
+def _cache_history(user_id, messages):
+    """Запомнить историю под текущим mtime файла сообщений"""
+    mtime = os.stat(_messages_path(user_id)).st_mtime_ns
+    _history_cache[user_id] = (mtime, list(messages))
+    _history_cache.move_to_end(user_id)
+    if len(_history_cache) > HISTORY_CACHE_SIZE:
+        _history_cache.popitem(last=False)
 
 
 def get_conversation_history(user_id):
@@ -26,46 +208,40 @@ def get_conversation_history(user_id):
     Загрузить историю диалога пользователя
     Возвращает список сообщений в формате Claude API
     """
-    file_path = get_conversation_file_path(user_id)
+    messages_path = _messages_path(user_id)
     
-    if not os.path.exists(file_path):
-        logger.info(f"Creating new conversation for user {user_id}")
-        return []
+    try:
+        mtime = os.stat(messages_path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        if mtime is not None:
+            cached = _history_cache.get(user_id)
+            if cached is not None and cached[0] == mtime:
+                _history_cache.move_to_end(user_id)
+                return list(cached[1])
             
-        messages = data.get("messages", [])
+            # NDJSON пишет только save_conversation_history - уже в новом формате
+            messages = list(_iter_ndjson_messages(messages_path))
+            _cache_history(user_id, messages)
+            logger.info(f"Loaded {len(messages)} messages for user {user_id}")
+            return messages
         
-        # Конвертировать старый формат в новый если нужно
-        converted_messages = []
-        for msg in messages:
-            if isinstance(msg, dict):
-                # Если это старый формат с обёрткой JSON
-                if "role" in msg and "content" in msg:
-                    content = msg["content"]
-                    # Если content это JSON строка, попробуем распарсить
-                    if isinstance(content, str) and content.startswith("{"):
-                        try:
-                            parsed = json.loads(content)
-                            if "ai_message" in parsed:
-                                # Старый формат - извлечь ai_message
-                                converted_messages.append({
-                                    "role": msg["role"],
-                                    "content": parsed["ai_message"]
-                                })
-                            else:
-                                converted_messages.append(msg)
-                        except:
-                            converted_messages.append(msg)
-                    else:
-                        converted_messages.append(msg)
-                else:
-                    converted_messages.append(msg)
+        legacy_path = get_conversation_file_path(user_id)
+        if not os.path.exists(legacy_path):
+            logger.info(f"Creating new conversation for user {user_id}")
+            return []
         
-        logger.info(f"Loaded {len(converted_messages)} messages for user {user_id}")
-        return converted_messages
+        # Старый JSON файл: конвертируем один раз и сразу переносим в NDJSON
+        messages = [
+            _convert_legacy_message(msg)
+            for msg in _iter_messages(legacy_path)
+            if isinstance(msg, dict)
+        ]
+        save_conversation_history(user_id, messages)
+        logger.info(f"Migrated {len(messages)} messages for user {user_id}")
+        return messages
         
     except Exception as e:
         logger.error(f"Error loading conversation for user {user_id}: {e}")
@@ -73,20 +249,36 @@ def get_conversation_history(user_id):
 
 
 def save_conversation_history(user_id, messages):
-    """Сохранить историю диалога"""
-    file_path = get_conversation_file_path(user_id)
+    """
+    Сохранить историю диалога
+    
+    Обычно в список добавлены сообщения в конец - они дописываются в файл.
+    После сжатия/очистки файл переписывается атомарно
+    """
+    messages_path = _messages_path(user_id)
     
     try:
-        data = {
+        stored = _count_stored_messages(user_id)
+        
+        if user_id in _rewrite_pending or stored is None or len(messages) < stored:
+            _write_atomic(messages_path, b"".join(
+                _json_dumps_line(msg) for msg in messages
+            ))
+            _rewrite_pending.discard(user_id)
+            legacy_path = get_conversation_file_path(user_id)
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+        elif len(messages) > stored:
+            with open(messages_path, 'ab') as f:
+                f.write(b"".join(_json_dumps_line(msg) for msg in messages[stored:]))
+        
+        _write_atomic(_meta_path(user_id), _json_dumps({
             "user_id": user_id,
             "last_updated": datetime.now().isoformat(),
-            "message_count": len(messages),
-            "messages": messages
-        }
-        
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+            "message_count": len(messages)
+        }))
         
+        _cache_history(user_id, messages)
         logger.info(f"Saved {len(messages)} messages for user {user_id}")
         
     except Exception as e:
@@ -101,6 +293,7 @@ def compress_history_if_needed(messages, user_id):
     # Проверка по количеству сообщений
     if len(messages) > MAX_MESSAGES:
         logger.info(f"Compressing history for user {user_id} ({len(messages)} messages)")
+        _rewrite_pending.add(user_id)
         
         # Оставить последние MAX_MESSAGES сообщений
         compressed = messages[-MAX_MESSAGES:]
@@ -118,22 +311,39 @@ def compress_history_if_needed(messages, user_id):
 
 def clear_conversation_history(user_id):
     """Очистить историю диалога"""
-    file_path = get_conversation_file_path(user_id)
+    paths = (_messages_path(user_id), _meta_path(user_id), get_conversation_file_path(user_id))
+    _rewrite_pending.discard(user_id)
+    _history_cache.pop(user_id, None)
     
     try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        removed = False
+        for file_path in paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                removed = True
+        if removed:
             logger.info(f"Cleared conversation for user {user_id}")
-            return True
+        return removed
     except Exception as e:
         logger.error(f"Error clearing conversation for user {user_id}: {e}")
         return False
-    
-    return False
 
 
 def get_conversation_stats(user_id):
     """Получить статистику диалога"""
+    messages_path = _messages_path(user_id)
+    if os.path.exists(messages_path):
+        try:
+            meta = _read_meta(user_id) or {}
+            return {
+                "messages": meta.get("message_count", 0),
+                "size_mb": round(os.path.getsize(messages_path) / (1024 * 1024), 2),
+                "last_updated": meta.get("last_updated")
+            }
+        except Exception as e:
+            logger.error(f"Error getting stats for user {user_id}: {e}")
+    
+    # Старый формат: служебные поля в начале JSON файла
     file_path = get_conversation_file_path(user_id)
     
     if not os.path.exists(file_path):
@@ -148,9 +358,8 @@ def get_conversation_stats(user_id):
         size_bytes = os.path.getsize(file_path)
         size_mb = size_bytes / (1024 * 1024)
         
-        # Загрузить данные
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        # Загрузить только заголовок, без сообщений
+        data = _read_header(file_path)
         
         return {
             "messages": data.get("message_count", 0),
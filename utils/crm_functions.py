@@ -5,40 +5,211 @@ CRM функции для работы с пользователями и тик
 
 import json
 import os
+import time
+from itertools import islice
 from datetime import datetime
 from typing import Dict, List, Optional
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Пути к CRM данным
 CRM_DATA_DIR = Path(__file__).parent.parent / "crm_data"
 USERS_FILE = CRM_DATA_DIR / "users.json"
-TICKETS_FILE = CRM_DATA_DIR / "tickets.json"
+TICKETS_FILE = CRM_DATA_DIR / "tickets.json"  # старый формат, мигрируется в лог
+TICKETS_LOG = CRM_DATA_DIR / "tickets.jsonl"
+
+# Лог тикетов переписывается из памяти, когда в нём столько событий сверх числа тикетов
+TICKETS_COMPACT_THRESHOLD = 500
 
 # Создаём директорию если не существует
 CRM_DATA_DIR.mkdir(exist_ok=True)
 
+# Разобранные JSON файлы: path -> (mtime_ns, data)
+_json_cache = {}
+
+# Тикеты в памяти: {"tickets": {...}, "_next_ticket_id": N}, строятся из лога один раз
+_tickets_data = None
+_log_events = 0
+
+# Готовые строки get_ticket_context: telegram_id -> str, сбрасываются при изменениях
+_context_cache = {}
+
+# Последняя метка времени: (monotonic_ns, isoformat), обновляется не чаще раза в 1 мс
+_NOW_RESOLUTION_NS = 1_000_000
+_now_cache = (None, "")
+
+# Индекс telegram_id -> [ticket_id] в порядке создания (ID выдаются по возрастанию)
+_tickets_by_user = {}
+
+
+def _json_dumps(data, indent: bool = False) -> bytes:
+    """Сериализовать в UTF-8 bytes (orjson, если установлен)"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(data, option=option)
+    return json.dumps(data, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def _json_loads(data):
+    """Разобрать JSON из bytes/str (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _now_iso() -> str:
+    """datetime.now().isoformat() с точностью до 1 мс, без пересчёта на каждый вызов"""
+    global _now_cache
+    tick = time.monotonic_ns()
+    last_tick, last_iso = _now_cache
+    if last_tick is None or tick - last_tick >= _NOW_RESOLUTION_NS:
+        last_iso = datetime.now().isoformat()
+        _now_cache = (tick, last_iso)
+    return last_iso
+
 
 def _load_json(filepath: Path) -> dict:
-    """Загрузить JSON файл"""
-    if not filepath.exists():
+    """Загрузить JSON файл (из кэша, если файл не менялся с прошлого чтения)"""
+    try:
+        mtime = os.stat(filepath).st_mtime_ns
+    except FileNotFoundError:
         return {}
+    
+    cached = _json_cache.get(filepath)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(filepath, 'rb') as f:
+            data = _json_loads(f.read())
     except Exception as e:
         print(f"Error loading {filepath}: {e}")
         return {}
+    _json_cache[filepath] = (mtime, data)
+    return data
 
 
 def _save_json(filepath: Path, data: dict):
     """Сохранить JSON файл"""
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(filepath, 'wb') as f:
+            f.write(_json_dumps(data, indent=True))
+        # Сохранённые данные и есть актуальное содержимое файла
+        _json_cache[filepath] = (os.stat(filepath).st_mtime_ns, data)
     except Exception as e:
+        _json_cache.pop(filepath, None)
         print(f"Error saving {filepath}: {e}")
 
 
+# === Лог тикетов (append-only JSONL) ===
+#
+# Каждая строка - событие:
+#   {"op": "create", "ticket": {...}}
+#   {"op": "update", "id": "...", "patch": {...}, "history": {...}}
+# Создание и обновление дописывают одну строку вместо перезаписи всего файла
+
+def _apply_event(tickets_data: dict, event: dict, by_user: Optional[dict] = None):
+    """Применить событие лога к состоянию в памяти (и к индексу by_user, если задан)"""
+    tickets = tickets_data["tickets"]
+    if event["op"] == "create":
+        ticket = event["ticket"]
+        tickets[ticket["id"]] = ticket
+        if by_user is not None:
+            by_user.setdefault(ticket["user_id"], []).append(ticket["id"])
+        number = int(ticket["id"].rsplit("_", 1)[-1])
+        tickets_data["_next_ticket_id"] = max(tickets_data["_next_ticket_id"], number + 1)
+    elif event["op"] == "update":
+        ticket = tickets.get(event["id"])
+        if ticket is None:
+            return
+        ticket.update(event.get("patch", {}))
+        if event.get("history"):
+            ticket["history"].append(event["history"])
+
+
+def replay_tickets_log(lines, by_user: Optional[dict] = None):
+    """
+    Воспроизвести лог событий тикетов
+    
+    Используется и CRM, и аналитикой (utils/data_analysis.py) - формат
+    событий разбирается только здесь
+    
+    Args:
+        lines: строки лога (bytes)
+        by_user: индекс telegram_id -> [ticket_id] для заполнения
+    
+    Returns:
+        (tickets_data, число применённых событий)
+    """
+    tickets_data = {"tickets": {}, "_next_ticket_id": 1}
+    events = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            _apply_event(tickets_data, _json_loads(line), by_user)
+            events += 1
+        except Exception as e:
+            print(f"Skipping bad event in {TICKETS_LOG}: {e}")
+    return tickets_data, events
+
+
+def _load_tickets() -> dict:
+    """Получить тикеты из памяти (при первом вызове - воспроизвести лог)"""
+    global _tickets_data, _log_events
+    if _tickets_data is not None:
+        return _tickets_data
+    
+    if TICKETS_LOG.exists():
+        with open(TICKETS_LOG, 'rb') as f:
+            _tickets_data, _log_events = replay_tickets_log(f, _tickets_by_user)
+    else:
+        # Миграция со старого tickets.json
+        tickets_data = {"tickets": {}, "_next_ticket_id": 1}
+        legacy = _load_json(TICKETS_FILE)
+        legacy_tickets = legacy.get("tickets", {})
+        tickets_data["tickets"] = legacy_tickets
+        tickets_data["_next_ticket_id"] = legacy.get("_next_ticket_id", 1)
+        for ticket in sorted(legacy_tickets.values(), key=lambda t: t["created_at"]):
+            _tickets_by_user.setdefault(ticket["user_id"], []).append(ticket["id"])
+        _tickets_data = tickets_data
+        _compact_tickets_log()
+    return _tickets_data
+
+
+def _append_event(event: dict):
+    """Дописать событие в лог, при разрастании - сжать лог"""
+    global _log_events
+    try:
+        with open(TICKETS_LOG, 'ab') as f:
+            f.write(_json_dumps(event) + b"\n")
+        _log_events += 1
+    except Exception as e:
+        print(f"Error appending to {TICKETS_LOG}: {e}")
+        return
+    
+    if _log_events - len(_tickets_data["tickets"]) > TICKETS_COMPACT_THRESHOLD:
+        _compact_tickets_log()
+
+
+def _compact_tickets_log():
+    """Переписать лог из памяти: одно событие create на тикет"""
+    global _log_events
+    tmp_path = TICKETS_LOG.with_suffix(".jsonl.tmp")
+    try:
+        with open(tmp_path, 'wb') as f:
+            for ticket in _tickets_data["tickets"].values():
+                f.write(_json_dumps({"op": "create", "ticket": ticket}) + b"\n")
+        os.replace(tmp_path, TICKETS_LOG)
+        _log_events = len(_tickets_data["tickets"])
+    except Exception as e:
+        print(f"Error compacting {TICKETS_LOG}: {e}")
+
+
 # === Работа с пользователями ===
 
 def get_user(telegram_id: int) -> Optional[Dict]:
@@ -51,6 +222,7 @@ def create_or_update_user(telegram_id: int, username: str = None, first_name: st
     """Создать или обновить пользователя"""
     users = _load_json(USERS_FILE)
     user_key = str(telegram_id)
+    now = _now_iso()
     
     if user_key not in users:
         # Новый пользователь
@@ -58,19 +230,23 @@ def create_or_update_user(telegram_id: int, username: str = None, first_name: st
             "telegram_id": telegram_id,
             "username": username,
             "first_name": first_name,
-            "registered_at": datetime.now().isoformat(),
+            "registered_at": now,
             "total_tickets": 0,
             "open_tickets": 0,
             "last_interaction": None
         }
     else:
         # Обновляем существующего
+        user = users[user_key]
+        if (username and username != user.get("username")) or \
+                (first_name and first_name != user.get("first_name")):
+            _context_cache.pop(telegram_id, None)
         if username:
-            users[user_key]["username"] = username
+            user["username"] = username
         if first_name:
-            users[user_key]["first_name"] = first_name
+            user["first_name"] = first_name
     
-    users[user_key]["last_interaction"] = datetime.now().isoformat()
+    users[user_key]["last_interaction"] = now
     _save_json(USERS_FILE, users)
     return users[user_key]
 
@@ -79,23 +255,19 @@ def create_or_update_user(telegram_id: int, username: str = None, first_name: st
 
 def get_user_tickets(telegram_id: int, status: str = None) -> List[Dict]:
     """Получить тикеты пользователя (опционально по статусу)"""
-    tickets_data = _load_json(TICKETS_FILE)
-    tickets = tickets_data.get("tickets", {})
+    tickets = _load_tickets()["tickets"]
     
-    user_tickets = []
-    for ticket_id, ticket in tickets.items():
-        if ticket["user_id"] == telegram_id:
-            if status is None or ticket["status"] == status:
-                user_tickets.append(ticket)
-    
-    # Сортируем по дате создания (новые сначала)
-    user_tickets.sort(key=lambda x: x["created_at"], reverse=True)
-    return user_tickets
+    # Индекс уже в порядке создания - разворачиваем (новые сначала)
+    return [
+        tickets[ticket_id]
+        for ticket_id in reversed(_tickets_by_user.get(telegram_id, []))
+        if status is None or tickets[ticket_id]["status"] == status
+    ]
 
 
 def get_ticket(ticket_id: str) -> Optional[Dict]:
     """Получить тикет по ID"""
-    tickets_data = _load_json(TICKETS_FILE)
+    tickets_data = _load_tickets()
     tickets = tickets_data.get("tickets", {})
     return tickets.get(ticket_id)
 
@@ -106,19 +278,13 @@ def create_ticket(
     assistant_response: str = None
 ) -> Dict:
     """Создать новый тикет"""
-    tickets_data = _load_json(TICKETS_FILE)
-    
-    if "tickets" not in tickets_data:
-        tickets_data["tickets"] = {}
-    if "_next_ticket_id" not in tickets_data:
-        tickets_data["_next_ticket_id"] = 1
+    tickets_data = _load_tickets()
     
-    # Генерируем ID
+    # Генерируем ID (счётчик увеличит _apply_event)
     ticket_id = f"ticket_{tickets_data['_next_ticket_id']:04d}"
-    tickets_data["_next_ticket_id"] += 1
     
     # Создаём тикет
-    now = datetime.now().isoformat()
+    now = _now_iso()
     ticket = {
         "id": ticket_id,
         "user_id": telegram_id,
@@ -137,11 +303,13 @@ def create_ticket(
             "assistant_response": assistant_response
         })
     
-    tickets_data["tickets"][ticket_id] = ticket
-    _save_json(TICKETS_FILE, tickets_data)
+    event = {"op": "create", "ticket": ticket}
+    _apply_event(tickets_data, event, _tickets_by_user)
+    _append_event(event)
+    _context_cache.pop(telegram_id, None)
     
     # Обновляем счётчики пользователя
-    _update_user_ticket_count(telegram_id)
+    _adjust_user_ticket_counts(telegram_id, total_delta=1, open_delta=1)
     
     return ticket
 
@@ -153,80 +321,91 @@ def update_ticket(
     status: str = None
 ) -> Optional[Dict]:
     """Обновить тикет (добавить сообщение или изменить статус)"""
-    tickets_data = _load_json(TICKETS_FILE)
-    tickets = tickets_data.get("tickets", {})
+    tickets_data = _load_tickets()
+    tickets = tickets_data["tickets"]
     
     if ticket_id not in tickets:
         return None
     
-    ticket = tickets[ticket_id]
-    now = datetime.now().isoformat()
+    old_status = tickets[ticket_id]["status"]
+    now = _now_iso()
+    event = {"op": "update", "id": ticket_id, "patch": {"updated_at": now}}
     
     # Добавляем новое взаимодействие в историю
     if user_message or assistant_response:
-        ticket["history"].append({
+        event["history"] = {
             "timestamp": now,
             "user_message": user_message or "",
             "assistant_response": assistant_response or ""
-        })
+        }
     
     # Обновляем статус
     if status:
-        ticket["status"] = status
+        event["patch"]["status"] = status
     
-    ticket["updated_at"] = now
-    tickets_data["tickets"][ticket_id] = ticket
-    _save_json(TICKETS_FILE, tickets_data)
+    _apply_event(tickets_data, event, _tickets_by_user)
+    _append_event(event)
+    ticket = tickets[ticket_id]
+    _context_cache.pop(ticket["user_id"], None)
     
-    # Обновляем счётчики если статус изменился
-    if status:
-        _update_user_ticket_count(ticket["user_id"])
+    # Обновляем счётчик открытых, если тикет открылся или закрылся
+    if status and status != old_status and "open" in (status, old_status):
+        _adjust_user_ticket_counts(ticket["user_id"], open_delta=1 if status == "open" else -1)
     
     return ticket
 
 
-def _update_user_ticket_count(telegram_id: int):
-    """Обновить счётчики тикетов у пользователя"""
+def _adjust_user_ticket_counts(telegram_id: int, total_delta: int = 0, open_delta: int = 0):
+    """Изменить счётчики тикетов у пользователя без пересчёта всех тикетов"""
     users = _load_json(USERS_FILE)
     user_key = str(telegram_id)
     
     if user_key not in users:
         return
     
-    # Подсчитываем тикеты
-    user_tickets = get_user_tickets(telegram_id)
-    open_tickets = [t for t in user_tickets if t["status"] == "open"]
-    
-    users[user_key]["total_tickets"] = len(user_tickets)
-    users[user_key]["open_tickets"] = len(open_tickets)
+    user = users[user_key]
+    user["total_tickets"] = user.get("total_tickets", 0) + total_delta
+    user["open_tickets"] = max(0, user.get("open_tickets", 0) + open_delta)
+    _context_cache.pop(telegram_id, None)
     
     _save_json(USERS_FILE, users)
 
 
 def get_ticket_context(telegram_id: int) -> str:
     """Получить краткий контекст тикетов для промпта Claude"""
-    user = get_user(telegram_id)
-    open_tickets = get_user_tickets(telegram_id, status="open")
+    context = _context_cache.get(telegram_id)
+    if context is not None:
+        return context
     
+    user = get_user(telegram_id)
     if not user:
         return "Новый пользователь без истории."
     
+    # Последние открытые тикеты (до 3) - по индексу, без просмотра всех тикетов
+    tickets = _load_tickets()["tickets"]
+    open_tickets = list(islice(
+        (tickets[ticket_id] for ticket_id in reversed(_tickets_by_user.get(telegram_id, []))
+         if tickets[ticket_id]["status"] == "open"),
+        3
+    ))
+    
     context_parts = [
         f"**Пользователь:** {user.get('first_name', 'Unknown')} (@{user.get('username', 'unknown')})",
         f"**Всего тикетов:** {user['total_tickets']}",
         f"**Открытых тикетов:** {user['open_tickets']}"
     ]
     
-    # Добавляем последние открытые тикеты (до 3)
     if open_tickets:
         context_parts.append("\n**Последние открытые тикеты:**")
-        for ticket in open_tickets[:3]:
+        for ticket in open_tickets:
             context_parts.append(
                 f"- [{ticket['id']}] {ticket['question'][:100]}... "
                 f"(создан: {ticket['created_at'][:10]})"
             )
     
-    return "\n".join(context_parts)
+    context = "\n".join(context_parts)
+    _context_cache[telegram_id] = context
+    return context
 
 
 # === Статистика ===
@@ -234,8 +413,7 @@ def get_ticket_context(telegram_id: int) -> str:
 def get_crm_stats() -> Dict:
     """Получить общую статистику CRM"""
     users = _load_json(USERS_FILE)
-    tickets_data = _load_json(TICKETS_FILE)
-    tickets = tickets_data.get("tickets", {})
+    tickets = _load_tickets()["tickets"]
     
     open_count = sum(1 for t in tickets.values() if t["status"] == "open")
     closed_count = sum(1 for t in tickets.values() if t["status"] == "closed")
@@ -2,24 +2,193 @@
 Анализ данных через готовые шаблоны (без Code Generation)
 """
 
+import os
+import re
 import json
+import mmap
 import logging
 import matplotlib
 matplotlib.use('Agg')  # Без GUI
-import matplotlib.pyplot as plt
-from collections import Counter
+from matplotlib.figure import Figure
+import numpy as np
 from datetime import datetime
+from utils.crm_functions import replay_tickets_log
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
-TICKETS_PATH = "/root/telegram-bot/crm_data/tickets.json"
+TICKETS_PATH = "/root/telegram-bot/crm_data/tickets.json"  # старый формат
+TICKETS_LOG_PATH = "/root/telegram-bot/crm_data/tickets.jsonl"  # лог событий CRM
+
+# Ключевые слова для маршрутизации вопроса: один проход regex вместо десятка `in`.
+# Lookahead находит и пересекающиеся совпадения ("покажи распределение" и "распределение")
+_KEYWORDS = (
+    'сколько', 'всего', 'тикет', 'процент', '%', 'успешн', 'решён', 'решен',
+    'приоритет', 'high', 'график', 'диаграмм', 'визуализ', 'построй',
+    'покажи распределение', 'распределение', 'статус', 'топ', 'частые',
+    'популярн', 'тем', 'вопрос', 'проблем', 'пять', '5',
+)
+_KEYWORD_RE = re.compile('(?=(' + '|'.join(map(re.escape, _KEYWORDS)) + '))')
+
+_SUCCESS_WORDS = frozenset({'успешн', 'решён', 'решен'})
+_PLOT_WORDS = frozenset({'график', 'диаграмм', 'визуализ', 'построй', 'покажи распределение'})
+_TOP_WORDS = frozenset({'топ', 'частые', 'популярн'})
+_TOPIC_WORDS = frozenset({'тем', 'вопрос', 'проблем'})
+
+PLOT_PATH = "/tmp/plot.png"
+
+# Одна фигура на все графики: очищается между отрисовками вместо создания новой.
+# PNG сжимается быстрее (compress_level=3 вместо 6) ценой ~10% размера
+_figure = None
+_PNG_KWARGS = {'compress_level': 3}
+
+# Цвета столбцов графика приоритетов (остальные - gray)
+PRIORITY_COLORS = {'urgent': '#d32f2f', 'high': '#f57c00', 'medium': '#fbc02d', 'low': '#388e3c'}
+
+# Разобранные тикеты: path -> (st_mtime_ns, st_size, tickets)
+_tickets_cache = {}
+
+# Колонки (numpy) для подсчётов: (tickets, columns), пересобираются при смене tickets
+_columns_cache = (None, None)
 
 
 def load_tickets():
-    """Загрузить все тикеты"""
-    with open(TICKETS_PATH, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return data['tickets']
+    """
+    Загрузить все тикеты
+    
+    Результат кэшируется до изменения файла (mtime/size): повторные
+    вопросы к аналитике не перечитывают и не разбирают файл заново
+    """
+    path = TICKETS_LOG_PATH if os.path.exists(TICKETS_LOG_PATH) else TICKETS_PATH
+    st = os.stat(path)
+    cached = _tickets_cache.get(path)
+    if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+    
+    if st.st_size == 0:
+        tickets = {}
+    else:
+        # mmap: файл читается страницами ядра, без промежуточной копии в Python
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if path == TICKETS_LOG_PATH:
+                # Лог событий CRM воспроизводится тем же кодом, что и в CRM
+                tickets = replay_tickets_log(iter(mm.readline, b""))[0]["tickets"]
+            elif orjson is not None:
+                with memoryview(mm) as view:
+                    tickets = orjson.loads(view)['tickets']
+            else:
+                tickets = json.loads(mm[:])['tickets']
+    
+    _tickets_cache[path] = (st.st_mtime_ns, st.st_size, tickets)
+    return tickets
+
+
+def _encode(values, count: int):
+    """Категориальное кодирование: int32 коды + метки в порядке появления"""
+    labels = {}
+    codes = np.fromiter(
+        (labels.setdefault(v, len(labels)) for v in values),
+        dtype=np.int32,
+        count=count
+    )
+    return codes, list(labels)
+
+
+def _first_user_message(ticket: dict):
+    """Первый вопрос пользователя в тикете (None если его нет)"""
+    history = ticket.get('history')
+    if history:
+        return history[0].get('user_message') or None
+    return None
+
+
+def load_ticket_columns(tickets: dict) -> dict:
+    """
+    Поля тикетов в виде массивов (Struct-of-Arrays)
+    
+    Строятся один раз на загруженный набор тикетов: подсчёты по статусу,
+    приоритету и rag_success идут по массивам, без обхода словарей
+    """
+    global _columns_cache
+    if _columns_cache[0] is tickets:
+        return _columns_cache[1]
+    
+    n = len(tickets)
+    priority = _encode((t.get('priority', 'unknown') for t in tickets.values()), n)
+    columns = {
+        "status": _encode((t.get('status', 'unknown') for t in tickets.values()), n),
+        "priority": priority,
+        # Цвет на каждую метку priority (в том же порядке) - считается один раз
+        "priority_colors": [PRIORITY_COLORS.get(p, 'gray') for p in priority[1]],
+        "rag_success": np.fromiter(
+            (bool(t.get('rag_success')) for t in tickets.values()), dtype=bool, count=n
+        ),
+        # Готовые текстовые ответы для этого набора тикетов: ключ ветки -> str
+        "answers": {},
+    }
+    _columns_cache = (tickets, columns)
+    return columns
+
+
+def _first_message_column(tickets: dict, columns: dict):
+    """
+    Колонка первых вопросов пользователей - строится по требованию
+
+    Свободный текст: меток почти столько же, сколько тикетов, и нужна колонка
+    только для топа вопросов, поэтому при загрузке тикетов она не собирается
+    """
+    column = columns.get("first_message")
+    if column is None:
+        column = columns["first_message"] = _encode(
+            (_first_user_message(t) for t in tickets.values()), len(tickets)
+        )
+    return column
+
+
+def _value_counts(column) -> dict:
+    """Число тикетов на каждую метку категориальной колонки"""
+    codes, labels = column
+    counts = np.bincount(codes, minlength=len(labels))
+    return {label: int(n) for label, n in zip(labels, counts)}
+
+
+def _top_values(column, top_n: int) -> list:
+    """
+    Самые частые метки колонки: [(label, count)], как Counter.most_common
+    (при равенстве - в порядке появления). None не учитывается
+    """
+    codes, labels = column
+    counts = np.bincount(codes, minlength=len(labels))
+    if None in labels:
+        counts[labels.index(None)] = 0
+    order = np.argsort(-counts, kind='stable')[:top_n]
+    return [(labels[i], int(counts[i])) for i in order if counts[i] > 0]
+
+
+def _render_bar_chart(labels, values, color, title: str, xlabel: str) -> str:
+    """Нарисовать столбчатую диаграмму в PLOT_PATH (переиспользуя фигуру)"""
+    global _figure
+    if _figure is None:
+        _figure = Figure(figsize=(10, 6))
+        # Поля под повёрнутые подписи задаются один раз вместо tight_layout
+        _figure.subplots_adjust(left=0.08, right=0.97, top=0.88, bottom=0.2)
+    
+    _figure.clear()
+    ax = _figure.add_subplot()
+    ax.bar(labels, values, color=color)
+    ax.set_title(title, fontsize=14, pad=20)
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel('Количество', fontsize=12)
+    ax.tick_params(axis='x', labelrotation=45)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment('right')
+    
+    _figure.savefig(PLOT_PATH, dpi=100, bbox_inches='tight', pil_kwargs=_PNG_KWARGS)
+    return PLOT_PATH
 
 
 async def analyze_data(question: str, ollama_client=None) -> dict:
@@ -31,11 +200,12 @@ async def analyze_data(question: str, ollama_client=None) -> dict:
     
     try:
         tickets = load_tickets()
-        q = question.lower()
+        columns = load_ticket_columns(tickets)
+        tags = frozenset(_KEYWORD_RE.findall(question.lower()))
         
         # === ПРОСТЫЕ ЗАПРОСЫ ===
         
-        if 'сколько' in q and 'всего' in q and 'тикет' in q:
+        if {'сколько', 'всего', 'тикет'} <= tags:
             total = len(tickets)
             return {
                 "success": True,
@@ -45,10 +215,11 @@ async def analyze_data(question: str, ollama_client=None) -> dict:
                 "error": None
             }
         
-        if ('процент' in q or '%' in q) and ('успешн' in q or 'решён' in q or 'решен' in q):
-            successful = sum(1 for t in tickets.values() if t.get('rag_success'))
-            total = len(tickets)
-            pct = (successful / total * 100) if total > 0 else 0
+        if tags & {'процент', '%'} and tags & _SUCCESS_WORDS:
+            rag_success = columns["rag_success"]
+            total = rag_success.size
+            successful = int(rag_success.sum())
+            pct = float(rag_success.mean() * 100) if total > 0 else 0.0
             return {
                 "success": True,
                 "answer": f"Успешно решено: {successful}/{total} ({pct:.1f}%)",
@@ -57,8 +228,9 @@ async def analyze_data(question: str, ollama_client=None) -> dict:
                 "error": None
             }
         
-        if 'приоритет' in q and 'high' in q:
-            high = sum(1 for t in tickets.values() if t.get('priority') == 'high')
+        if {'приоритет', 'high'} <= tags:
+            codes, labels = columns["priority"]
+            high = int((codes == labels.index('high')).sum()) if 'high' in labels else 0
             return {
                 "success": True,
                 "answer": f"Тикетов с приоритетом high: {high}",
@@ -69,91 +241,67 @@ async def analyze_data(question: str, ollama_client=None) -> dict:
         
         # === ГРАФИКИ ===
         
-        if 'график' in q or 'диаграмм' in q or 'визуализ' in q or 'построй' in q or 'покажи распределение' in q:
+        if tags & _PLOT_WORDS:
             
-            if 'статус' in q:
+            if 'статус' in tags:
                 # График по статусам
-                counts = {}
-                for t in tickets.values():
-                    s = t.get('status', 'unknown')
-                    counts[s] = counts.get(s, 0) + 1
+                counts = _value_counts(columns["status"])
                 
-                plt.figure(figsize=(10, 6))
-                plt.bar(counts.keys(), counts.values(), color='steelblue')
-                plt.title('Распределение тикетов по статусам', fontsize=14, pad=20)
-                plt.xlabel('Статус', fontsize=12)
-                plt.ylabel('Количество', fontsize=12)
-                plt.xticks(rotation=45, ha='right')
-                plt.tight_layout()
-                plt.savefig('/tmp/plot.png', dpi=100, bbox_inches='tight')
-                plt.close()
+                plot_path = _render_bar_chart(
+                    list(counts.keys()), list(counts.values()), 'steelblue',
+                    'Распределение тикетов по статусам', 'Статус'
+                )
                 
                 summary = "\n".join([f"{s}: {n}" for s, n in counts.items()])
                 
                 return {
                     "success": True,
                     "answer": f"Распределение по статусам:\n{summary}",
-                    "plot_path": "/tmp/plot.png",
+                    "plot_path": plot_path,
                     "code": None,
                     "error": None
                 }
             
-            elif 'приоритет' in q:
+            elif 'приоритет' in tags:
                 # График по приоритетам
-                counts = {}
-                for t in tickets.values():
-                    p = t.get('priority', 'unknown')
-                    counts[p] = counts.get(p, 0) + 1
+                counts = _value_counts(columns["priority"])
                 
-                plt.figure(figsize=(10, 6))
-                colors = {'urgent': '#d32f2f', 'high': '#f57c00', 'medium': '#fbc02d', 'low': '#388e3c'}
-                bar_colors = [colors.get(p, 'gray') for p in counts.keys()]
-                plt.bar(counts.keys(), counts.values(), color=bar_colors)
-                plt.title('Распределение тикетов по приоритетам', fontsize=14, pad=20)
-                plt.xlabel('Приоритет', fontsize=12)
-                plt.ylabel('Количество', fontsize=12)
-                plt.xticks(rotation=45, ha='right')
-                plt.tight_layout()
-                plt.savefig('/tmp/plot.png', dpi=100, bbox_inches='tight')
-                plt.close()
+                plot_path = _render_bar_chart(
+                    list(counts.keys()), list(counts.values()), columns["priority_colors"],
+                    'Распределение тикетов по приоритетам', 'Приоритет'
+                )
                 
                 summary = "\n".join([f"{p}: {n}" for p, n in counts.items()])
                 
                 return {
                     "success": True,
                     "answer": f"Распределение по приоритетам:\n{summary}",
-                    "plot_path": "/tmp/plot.png",
+                    "plot_path": plot_path,
                     "code": None,
                     "error": None
                 }
         
         # === ТОПОВЫЕ ВОПРОСЫ ===
         
-        if ('топ' in q or 'частые' in q or 'популярн' in q) and ('тем' in q or 'вопрос' in q or 'проблем' in q):
-            questions = []
-            for t in tickets.values():
-                history = t.get('history', [])
-                if history:
-                    msg = history[0].get('user_message', '')
-                    if msg:
-                        questions.append(msg)
-            
-            counter = Counter(questions)
+        if tags & _TOP_WORDS and tags & _TOPIC_WORDS:
             top_n = 3
-            if 'пять' in q or '5' in q:
+            if tags & {'пять', '5'}:
                 top_n = 5
             
-            top_items = counter.most_common(top_n)
-            
-            result_lines = [f"Топ-{top_n} вопросов:"]
-            for i, (question_text, count) in enumerate(top_items, 1):
-                # Обрезаем длинные вопросы
-                short_q = question_text[:60] + '...' if len(question_text) > 60 else question_text
-                result_lines.append(f"{i}. {short_q} ({count} раз)")
+            answer = columns["answers"].get(("top", top_n))
+            if answer is None:
+                top_items = _top_values(_first_message_column(tickets, columns), top_n)
+                
+                result_lines = [f"Топ-{top_n} вопросов:"]
+                for i, (question_text, count) in enumerate(top_items, 1):
+                    # Обрезаем длинные вопросы
+                    short_q = question_text[:60] + '...' if len(question_text) > 60 else question_text
+                    result_lines.append(f"{i}. {short_q} ({count} раз)")
+                answer = columns["answers"][("top", top_n)] = "\n".join(result_lines)
             
             return {
                 "success": True,
-                "answer": "\n".join(result_lines),
+                "answer": answer,
                 "plot_path": None,
                 "code": None,
                 "error": None
@@ -161,21 +309,21 @@ async def analyze_data(question: str, ollama_client=None) -> dict:
         
         # === СТАТИСТИКА ПО СТАТУСАМ ===
         
-        if 'распределение' in q and 'статус' in q and 'график' not in q:
-            counts = {}
-            for t in tickets.values():
-                s = t.get('status', 'unknown')
-                counts[s] = counts.get(s, 0) + 1
-            
-            total = len(tickets)
-            lines = ["Распределение по статусам:"]
-            for status, count in sorted(counts.items()):
-                pct = (count / total * 100) if total > 0 else 0
-                lines.append(f"• {status}: {count} ({pct:.1f}%)")
+        if {'распределение', 'статус'} <= tags and 'график' not in tags:
+            answer = columns["answers"].get("status_summary")
+            if answer is None:
+                counts = _value_counts(columns["status"])
+                
+                total = len(tickets)
+                lines = ["Распределение по статусам:"]
+                for status, count in sorted(counts.items()):
+                    pct = (count / total * 100) if total > 0 else 0
+                    lines.append(f"• {status}: {count} ({pct:.1f}%)")
+                answer = columns["answers"]["status_summary"] = "\n".join(lines)
             
             return {
                 "success": True,
-                "answer": "\n".join(lines),
+                "answer": answer,
                 "plot_path": None,
                 "code": None,
                 "error": None
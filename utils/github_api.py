@@ -4,15 +4,61 @@
 """
 
 import os
+import asyncio
 import logging
 import aiohttp
-from typing import Optional
+from typing import Optional, Union
 
 logger = logging.getLogger(__name__)
 
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 GITHUB_API_BASE = "https://api.github.com"
 
+# Общая сессия: keep-alive и DNS кэш между запросами к API.
+# Сессия привязана к event loop - process_pr_review выполняет все ревью
+# в одном долгоживущем loop, поэтому соединения переиспользуются между PR
+_session = None
+_session_loop = None
+
+
+async def _get_session() -> aiohttp.ClientSession:
+    """Получить (или создать) общую сессию для текущего event loop"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        await _close_stale_session()
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+        _session_loop = loop
+    return _session
+
+
+async def _close_stale_session():
+    """Закрыть сессию, привязанную к другому event loop, перед заменой"""
+    if _session is None or _session.closed:
+        return
+    if _session_loop is not None and _session_loop.is_running():
+        # Loop живёт в другом потоке - закрываем сессию в нём
+        asyncio.run_coroutine_threadsafe(_session.close(), _session_loop)
+        return
+    try:
+        await _session.close()
+    except RuntimeError as e:
+        # Соединения принадлежат уже закрытому loop - их сокеты освободит GC
+        logger.debug(f"Stale GitHub API session closed with error: {e}")
+        _session.detach()
+
+
+async def close_session():
+    """Закрыть общую сессию (в конце работы event loop)"""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
 async def post_pr_comment(
     owner: str, 
     repo: str, 
@@ -57,25 +103,25 @@ async def post_pr_comment(
     }
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url, 
-                headers=headers, 
-                json=payload
-            ) as response:
-                
-                if response.status == 201:
-                    logger.info(
-                        f"Комментарий успешно опубликован в PR #{pr_number}"
-                    )
-                    return True
-                else:
-                    error_text = await response.text()
-                    logger.error(
-                        f"Ошибка при публикации комментария: "
-                        f"{response.status} - {error_text}"
-                    )
-                    return False
+        session = await _get_session()
+        async with session.post(
+            url, 
+            headers=headers, 
+            json=payload
+        ) as response:
+            
+            if response.status == 201:
+                logger.info(
+                    f"Комментарий успешно опубликован в PR #{pr_number}"
+                )
+                return True
+            else:
+                error_text = await response.text()
+                logger.error(
+                    f"Ошибка при публикации комментария: "
+                    f"{response.status} - {error_text}"
+                )
+                return False
                     
     except Exception as e:
         logger.error(f"Исключение при публикации комментария: {e}")
@@ -84,8 +130,9 @@ async def post_pr_comment(
 async def get_pr_diff(
     owner: str, 
     repo: str, 
-    pr_number: int
-) -> Optional[str]:
+    pr_number: int,
+    decode: bool = True
+) -> Optional[Union[str, bytes]]:
     """
     Получение diff Pull Request
     
@@ -93,9 +140,10 @@ async def get_pr_diff(
         owner: Владелец репозитория
         repo: Название репозитория
         pr_number: Номер PR
+        decode: False - вернуть bytes без декодирования UTF-8
     
     Returns:
-        str: Содержимое diff или None
+        str (или bytes при decode=False): Содержимое diff или None
     """
     if not GITHUB_TOKEN:
         logger.error("GITHUB_TOKEN не установлен")
@@ -110,23 +158,26 @@ async def get_pr_diff(
     }
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                
-                if response.status == 200:
-                    diff_content = await response.text()
-                    logger.info(
-                        f"Получен diff для PR #{pr_number}, "
-                        f"размер: {len(diff_content)} символов"
-                    )
-                    return diff_content
-                else:
-                    error_text = await response.text()
-                    logger.error(
-                        f"Ошибка при получении diff: "
-                        f"{response.status} - {error_text}"
-                    )
-                    return None
+        session = await _get_session()
+        async with session.get(url, headers=headers) as response:
+            
+            if response.status == 200:
+                # read() + decode без определения кодировки, как в response.text()
+                raw_diff = await response.read()
+                logger.info(
+                    f"Получен diff для PR #{pr_number}, "
+                    f"размер: {len(raw_diff)} байт"
+                )
+                if not decode:
+                    return raw_diff
+                return raw_diff.decode('utf-8', 'replace')
+            else:
+                error_text = await response.text()
+                logger.error(
+                    f"Ошибка при получении diff: "
+                    f"{response.status} - {error_text}"
+                )
+                return None
                     
     except Exception as e:
         logger.error(f"Исключение при получении diff: {e}")
@@ -161,22 +212,22 @@ async def get_pr_files(
     }
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                
-                if response.status == 200:
-                    files_data = await response.json()
-                    logger.info(
-                        f"Получено {len(files_data)} файлов для PR #{pr_number}"
-                    )
-                    return files_data
-                else:
-                    error_text = await response.text()
-                    logger.error(
-                        f"Ошибка при получении файлов: "
-                        f"{response.status} - {error_text}"
-                    )
-                    return []
+        session = await _get_session()
+        async with session.get(url, headers=headers) as response:
+            
+            if response.status == 200:
+                files_data = await response.json()
+                logger.info(
+                    f"Получено {len(files_data)} файлов для PR #{pr_number}"
+                )
+                return files_data
+            else:
+                error_text = await response.text()
+                logger.error(
+                    f"Ошибка при получении файлов: "
+                    f"{response.status} - {error_text}"
+                )
+                return []
                     
     except Exception as e:
         logger.error(f"Исключение при получении файлов: {e}")
@@ -4,8 +4,12 @@
 GitHub RAG функции - поиск по репозиториям GitHub через Contents API
 """
 
+import re
+import time
+import asyncio
 import logging
 import base64
+from collections import OrderedDict
 from typing import List, Dict
 
 logger = logging.getLogger(__name__)
@@ -13,6 +17,18 @@ logger = logging.getLogger(__name__)
 # Глобальная ссылка на GitHub client
 _github_client = None
 
+# Одновременных запросов файлов без batch инструмента (вторичный rate limit GitHub)
+FETCH_CONCURRENCY = 8
+_fetch_sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+# Декодированные файлы: (owner, repo, path) -> (время, sha, result), LRU.
+# Ключ известен до запроса: свежая запись отдаётся без обращения к MCP серверу.
+# После DECODED_CACHE_TTL файл запрашивается снова, но при том же sha blob
+# повторно не декодируется
+DECODED_CACHE_SIZE = 256
+DECODED_CACHE_TTL = 300  # 5 минут
+_decoded_cache = OrderedDict()
+
 
 def set_github_client(client):
     """Установить глобальный GitHub client"""
@@ -20,6 +36,102 @@ def set_github_client(client):
     _github_client = client
 
 
+async def _fetch_file_text(owner: str, repo: str, file_path: str):
+    """
+    Получить один файл (если batch инструмент недоступен)
+    
+    Returns:
+        bytes (декодированный base64, без декодирования UTF-8),
+        str (если контент пришёл не в base64) или None
+    """
+    content_result = await _github_client.get_file_contents(owner, repo, file_path)
+    
+    if not content_result:
+        return None
+    
+    # MCP GitHub возвращает JSON с метаданными
+    # Извлекаем content и encoding
+    file_content_encoded = content_result.get("content", "")
+    encoding = content_result.get("encoding", "")
+    
+    if not file_content_encoded:
+        return None
+    
+    if encoding != "base64":
+        return file_content_encoded
+    
+    # validate=False (по умолчанию) пропускает переносы строк и пробелы.
+    # UTF-8 декодируется только у файлов с совпадением
+    try:
+        return base64.b64decode(file_content_encoded)
+    except ValueError:
+        # Не base64 (например, уже декодированный текст с unicode)
+        return file_content_encoded
+
+
+def _compile_query(query: str):
+    """
+    Шаблоны поиска без учёта регистра: (для str, для bytes)
+    
+    Для bytes IGNORECASE работает только с ASCII, поэтому bytes шаблон
+    строится лишь для ASCII запроса, иначе None
+    """
+    text_pattern = re.compile(re.escape(query), re.IGNORECASE)
+    bytes_pattern = None
+    if query.isascii():
+        bytes_pattern = re.compile(re.escape(query.encode()), re.IGNORECASE)
+    return text_pattern, bytes_pattern
+
+
+def _content_matching(content, text_pattern, bytes_pattern):
+    """Текст файла, если в нём есть запрос, иначе None"""
+    if isinstance(content, bytes):
+        if bytes_pattern is not None and not bytes_pattern.search(content):
+            return None
+        content = content.decode('utf-8', 'replace')
+    if not text_pattern.search(content):
+        return None
+    return content
+
+
+def _matching_lines(content: str, text_pattern, limit: int = 3) -> list:
+    """
+    Первые limit строк с совпадениями: [{"line_number", "text"}]
+    
+    Строки не разбиваются и не приводятся к нижнему регистру: номер строки
+    считается по переносам до совпадения
+    """
+    matches = []
+    line_number = 1
+    counted_to = 0
+    for m in text_pattern.finditer(content):
+        line_number += content.count('\n', counted_to, m.start())
+        counted_to = m.start()
+        if matches and matches[-1]["line_number"] == line_number:
+            continue  # несколько совпадений в одной строке
+        
+        line_start = content.rfind('\n', 0, m.start()) + 1
+        line_end = content.find('\n', m.end())
+        line = content[line_start:line_end if line_end != -1 else len(content)]
+        matches.append({
+            "line_number": line_number,
+            "text": line.strip()[:100]
+        })
+        if len(matches) >= limit:
+            break
+    return matches
+
+
+async def _fetch_file_text_bounded(owner: str, repo: str, file_path: str):
+    """_fetch_file_text под семафором; ошибка одного файла не прерывает поиск"""
+    async with _fetch_sem:
+        try:
+            return await _fetch_file_text(owner, repo, file_path)
+        except Exception as e:
+            logger.warning(f"Error fetching {file_path}: {e}")
+            return None
+
+
 async def search_in_repository(owner: str, repo: str, query: str) -> Dict:
     """
     Простой поиск по известным файлам репозитория
@@ -45,63 +157,29 @@ async def search_in_repository(owner: str, repo: str, query: str) -> Dict:
         ]
         
         results = []
-        query_lower = query.lower()
+        text_pattern, bytes_pattern = _compile_query(query)
+        
+        # Один batch запрос вместо N последовательных get_file_contents
+        batch = await _github_client.get_files(owner, repo, files_to_search)
         
-        for file_path in files_to_search:
+        if batch is not None:
+            contents = [batch.get(file_path) for file_path in files_to_search]
+        else:
+            # Без batch инструмента - запросы по файлам параллельно
+            contents = await asyncio.gather(*(
+                _fetch_file_text_bounded(owner, repo, file_path)
+                for file_path in files_to_search
+            ))
+        
+        for file_path, content in zip(files_to_search, contents):
             try:
-                content_result = await _github_client.get_file_contents(owner, repo, file_path)
-                
-                if not content_result:
-                    continue
-                
-                # MCP GitHub возвращает JSON с метаданными
-                # Извлекаем content и encoding
-                file_content_encoded = content_result.get("content", "")
-                encoding = content_result.get("encoding", "")
-                
-                if not file_content_encoded:
-                    continue
-                
-                # Декодируем base64
-                try:
-                    if encoding == "base64":
-                        # Убираем переносы строк и пробелы из base64
-                        file_content_clean = file_content_encoded.replace('\n', '').replace('\r', '').replace(' ', '')
-                        
-                        # base64 должен содержать только ASCII символы
-                        # Если есть unicode - значит это уже не base64, а декодированный контент
-                        # Попробуем как bytes (для корректного base64)
-                        try:
-                            # Пытаемся декодировать как чистый base64
-                            content = base64.b64decode(file_content_clean).decode('utf-8')
-                        except:
-                            # Если не получилось - возможно контент уже был декодирован
-                            # или содержит unicode символы, пробуем latin-1
-                            try:
-                                content = base64.b64decode(file_content_clean.encode('latin-1')).decode('utf-8')
-                            except:
-                                # В крайнем случае - считаем что это уже декодированный текст
-                                content = file_content_encoded
-                    else:
-                        content = file_content_encoded
-                        
-                except Exception as e:
-                    logger.warning(f"Failed to decode {file_path}: {e}")
+                if not content:
                     continue
                 
                 # Проверяем есть ли искомый текст
-                if query_lower in content.lower():
-                    # Находим строки с совпадениями
-                    lines = content.split('\n')
-                    matching_lines = []
-                    for i, line in enumerate(lines, 1):
-                        if query_lower in line.lower():
-                            matching_lines.append({
-                                "line_number": i,
-                                "text": line.strip()[:100]
-                            })
-                            if len(matching_lines) >= 3:
-                                break
+                content = _content_matching(content, text_pattern, bytes_pattern)
+                if content is not None:
+                    matching_lines = _matching_lines(content, text_pattern)
                     
                     results.append({
                         "path": file_path,
@@ -128,32 +206,36 @@ async def get_file_content(owner: str, repo: str, path: str) -> Dict:
     if not _github_client:
         return {"error": "GitHub client not initialized"}
     
+    cache_key = (owner, repo, path)
+    cached = _decoded_cache.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] <= DECODED_CACHE_TTL:
+        _decoded_cache.move_to_end(cache_key)
+        return dict(cached[2])
+    
     try:
         result = await _github_client.get_file_contents(owner, repo, path)
         
         if result and "content" in result:
             content = result["content"]
             encoding = result.get("encoding", "")
+            sha = result.get("sha")
             
+            # Файл не изменился с прошлого запроса - декодированный текст тот же
+            if cached is not None and sha and cached[1] == sha:
+                result["content"] = cached[2]["content"]
             # Декодируем base64
-            if encoding == "base64":
+            elif encoding == "base64":
                 try:
-                    # Убираем переносы строк и пробелы
-                    content_clean = content.replace('\n', '').replace('\r', '').replace(' ', '')
-                    
-                    # Пытаемся декодировать разными способами
-                    try:
-                        content = base64.b64decode(content_clean).decode('utf-8')
-                    except:
-                        try:
-                            content = base64.b64decode(content_clean.encode('latin-1')).decode('utf-8')
-                        except:
-                            # Оставляем как есть
-                            pass
-                    
-                    result["content"] = content
-                except Exception as e:
+                    # validate=False (по умолчанию) пропускает переносы строк и пробелы
+                    result["content"] = base64.b64decode(content).decode('utf-8', 'replace')
+                except ValueError as e:
+                    # Не base64 - оставляем content как есть
                     logger.error(f"Error decoding base64: {e}")
+            
+            _decoded_cache[cache_key] = (time.monotonic(), sha, dict(result))
+            _decoded_cache.move_to_end(cache_key)
+            if len(_decoded_cache) > DECODED_CACHE_SIZE:
+                _decoded_cache.popitem(last=False)
         
         return result
     except Exception as e:
@@ -4,31 +4,120 @@
 Вспомогательные функции для бота
 """
 
+import asyncio
+from anthropic import AsyncAnthropic
 from telegram import Update
+from config import ANTHROPIC_API_KEY
+
+# Частота обновления сообщения при потоковом ответе (лимиты Telegram на edit)
+STREAM_EDIT_INTERVAL = 0.5  # секунд
+STREAM_EDIT_CHUNKS = 40
+
+# Один клиент Claude API на процесс: общий пул HTTPS соединений для всех хендлеров
+_anthropic_client = None
+
+
+def get_anthropic_client() -> AsyncAnthropic:
+    """Получить общий AsyncAnthropic клиент (создаётся при первом вызове)"""
+    global _anthropic_client
+    if _anthropic_client is None:
+        _anthropic_client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+    return _anthropic_client
+
+
+def _iter_chunks(message: str, max_length: int):
+    """
+    Части сообщения до max_length символов: разрез по последнему переносу строки,
+    пробелы в начале следующей части отбрасываются. Идём по индексам, без
+    повторного копирования остатка строки
+    """
+    pos = 0
+    end = len(message)
+    while pos < end:
+        if end - pos <= max_length:
+            yield message[pos:]
+            return
+        
+        # Ищем перенос строки ближе к концу
+        split_pos = message.rfind('\n', pos, pos + max_length)
+        if split_pos == -1:
+            split_pos = pos + max_length
+        if split_pos > pos:
+            yield message[pos:split_pos]
+        
+        pos = split_pos
+        while pos < end and message[pos].isspace():
+            pos += 1
 
 
 async def send_long_message(update: Update, message: str, max_length: int = 4096):
     """
     Отправить длинное сообщение, разбив на части если необходимо
+    
+    Части отправляются последовательно: параллельные reply_text
+    могут прийти в чат не по порядку
     """
-    if len(message) <= max_length:
-        await update.message.reply_text(message)
-    else:
-        # Разбиваем на части
-        parts = []
-        while message:
-            if len(message) <= max_length:
-                parts.append(message)
-                break
-            
-            # Ищем перенос строки ближе к концу
-            split_pos = message.rfind('\n', 0, max_length)
-            if split_pos == -1:
-                split_pos = max_length
-            
-            parts.append(message[:split_pos])
-            message = message[split_pos:].lstrip()
+    for part in _iter_chunks(message, max_length):
+        await update.message.reply_text(part)
+
+
+async def _safe_edit(message, text: str, **kwargs):
+    """Отредактировать сообщение, игнорируя ошибки (например, "not modified")"""
+    try:
+        await message.edit_text(text, **kwargs)
+        return True
+    except Exception:
+        return False
+
+
+async def send_streaming_message(update: Update, chunks, max_length: int = 4096) -> str:
+    """
+    Отправить ответ по мере генерации: первое сообщение + периодические edit
+    
+    Args:
+        chunks: async iterator фрагментов текста
+    
+    Returns:
+        str: Полный текст ответа ('' если не получено ничего, кроме пробелов)
+    """
+    loop = asyncio.get_running_loop()
+    parts = []
+    reply = None
+    pending = 0
+    last_edit = loop.time()
+    
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        parts.append(chunk)
+        pending += 1
         
-        # Отправляем части
-        for part in parts:
-            await update.message.reply_text(part)
+        if reply is None:
+            # Telegram отклоняет пустой текст: первое сообщение - когда есть что показать
+            text = "".join(parts)
+            if text.strip():
+                reply = await update.message.reply_text(text[:max_length])
+                last_edit = loop.time()
+                pending = 0
+        elif pending >= STREAM_EDIT_CHUNKS or loop.time() - last_edit >= STREAM_EDIT_INTERVAL:
+            await _safe_edit(reply, "".join(parts)[:max_length])
+            last_edit = loop.time()
+            pending = 0
+    
+    text = "".join(parts)
+    if reply is None:
+        # Ничего не отправлено (пустой или только пробельный ответ)
+        return ""
+    
+    if len(text) <= max_length:
+        # Финальная версия с Markdown (если разметка невалидна - без неё)
+        if not await _safe_edit(reply, text, parse_mode='Markdown'):
+            await _safe_edit(reply, text)
+    else:
+        try:
+            await reply.delete()
+        except Exception:
+            pass
+        await send_long_message(update, text, max_length)
+    
+    return text
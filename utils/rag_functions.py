@@ -4,10 +4,18 @@
 RAG функции - работа с Retrieval-Augmented Generation с Reranker
 """
 
+import os
+import json
 import time
 import logging
+from collections import deque
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 from config import (
     RAG_COMPARISON_FILE,
     RAG_VECTOR_STORE_NAME,
@@ -17,6 +25,13 @@ from config import (
 
 logger = logging.getLogger(__name__)
 
+# Сравнения пишутся дозаписью по одной JSON строке; когда строк больше
+# COMPARISONS_COMPACT_AT, файл обрезается до последних COMPARISONS_KEEP
+RAG_COMPARISON_LOG = RAG_COMPARISON_FILE.with_suffix('.jsonl')
+COMPARISONS_KEEP = 100
+COMPARISONS_COMPACT_AT = 200
+_comparison_lines = None  # число строк в логе (считается при первой записи)
+
 # Глобальная ссылка на MCP Ollama client (устанавливается в bot.py)
 _ollama_client = None
 
@@ -42,7 +57,7 @@ async def get_rag_answer(query: str, rerank_mode: str, store_name: str = None) -
     if store_name is None:
         store_name = RAG_VECTOR_STORE_NAME
     
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     if not _ollama_client:
         return {
@@ -65,7 +80,7 @@ async def get_rag_answer(query: str, rerank_mode: str, store_name: str = None) -
             }
         )
         
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         
         if result:
             return {
@@ -87,7 +102,7 @@ async def get_rag_answer(query: str, rerank_mode: str, store_name: str = None) -
                 "rerank_mode": rerank_mode
             }
     except Exception as e:
-        elapsed = time.time() - start_time
+        elapsed = time.perf_counter() - start_time
         logger.error(f"Error in get_rag_answer: {e}")
         return {
             "answer": f"Ошибка: {str(e)}",
@@ -98,27 +113,64 @@ async def get_rag_answer(query: str, rerank_mode: str, store_name: str = None) -
         }
 
 
+def _json_line(data) -> bytes:
+    """Сериализовать в одну строку JSONL (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+    return json.dumps(data, ensure_ascii=False).encode('utf-8') + b"\n"
+
+
+def _json_loads(data):
+    """Разобрать JSON из bytes (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _count_comparison_lines() -> int:
+    """Число строк в логе сравнений (со старого rag_comparisons.json - миграция)"""
+    if not RAG_COMPARISON_LOG.exists() and RAG_COMPARISON_FILE.exists():
+        with open(RAG_COMPARISON_FILE, 'rb') as f:
+            legacy = _json_loads(f.read()).get("comparisons", [])[-COMPARISONS_KEEP:]
+        with open(RAG_COMPARISON_LOG, 'wb') as f:
+            f.writelines(_json_line(record) for record in legacy)
+        return len(legacy)
+    
+    if not RAG_COMPARISON_LOG.exists():
+        return 0
+    with open(RAG_COMPARISON_LOG, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def _compact_comparisons():
+    """Оставить в логе последние COMPARISONS_KEEP сравнений (атомарная замена файла)"""
+    global _comparison_lines
+    with open(RAG_COMPARISON_LOG, 'rb') as f:
+        tail = deque(f, maxlen=COMPARISONS_KEEP)
+    tmp_path = RAG_COMPARISON_LOG.with_suffix('.jsonl.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.writelines(tail)
+    os.replace(tmp_path, RAG_COMPARISON_LOG)
+    _comparison_lines = len(tail)
+
+
 def save_comparison(comparison_data: dict):
-    """Сохранить результат сравнения в файл"""
-    import json
+    """Сохранить результат сравнения в файл (дозапись одной строки)"""
+    global _comparison_lines
     
     try:
-        if RAG_COMPARISON_FILE.exists():
-            with open(RAG_COMPARISON_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-        else:
-            data = {"comparisons": []}
+        if _comparison_lines is None:
+            _comparison_lines = _count_comparison_lines()
         
         comparison_data["timestamp"] = datetime.now().isoformat()
-        data["comparisons"].append(comparison_data)
-        
-        # Ограничиваем до последних 100 сравнений
-        if len(data["comparisons"]) > 100:
-            data["comparisons"] = data["comparisons"][-100:]
+        with open(RAG_COMPARISON_LOG, 'ab') as f:
+            f.write(_json_line(comparison_data))
+        _comparison_lines += 1
         
-        with open(RAG_COMPARISON_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        if _comparison_lines > COMPARISONS_COMPACT_AT:
+            _compact_comparisons()
         
-        logger.info(f"Saved comparison to {RAG_COMPARISON_FILE}")
+        logger.info(f"Saved comparison to {RAG_COMPARISON_LOG}")
     except Exception as e:
+        _comparison_lines = None
         logger.error(f"Error saving comparison: {e}")
@@ -4,14 +4,36 @@ GitHub Webhook Server для автоматического code review
 Принимает webhook события от GitHub при создании/обновлении PR
 """
 
+import io
 import os
 import hmac
-import hashlib
 import json
+import binascii
+import time
 import logging
-from flask import Flask, request, jsonify
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.middleware.proxy_fix import ProxyFix
 from handlers.pr_review import process_pr_review
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from prometheus_client import Counter, start_http_server
+except ImportError:
+    Counter = None
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -21,23 +43,285 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# GitHub ограничивает payload webhook 25 MB. Тело больше лимита отклоняется
+# с 413 до чтения, поэтому HMAC никогда не считается по гигабайтному запросу
+MAX_PAYLOAD_SIZE = 26 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_PAYLOAD_SIZE
+
+# За nginx: число прокси, которым доверяем X-Forwarded-For/Proto
+# (иначе в логах remote_addr всегда 127.0.0.1)
+TRUSTED_PROXIES = int(os.getenv('WEBHOOK_TRUSTED_PROXIES', 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
 # GitHub webhook secret для валидации
 WEBHOOK_SECRET = os.getenv('GITHUB_WEBHOOK_SECRET', '')
+WEBHOOK_SECRET_BYTES = WEBHOOK_SECRET.encode('utf-8')
+SIGNATURE_PREFIX = 'sha256='
+SIGNATURE_LENGTH = len(SIGNATURE_PREFIX) + 64  # + hex SHA-256
+
+# Ревью выполняются в фоне: GitHub ждёт ответ webhook не дольше 10 секунд,
+# а ревью через Claude занимает до минуты
+REVIEW_WORKERS = int(os.getenv('REVIEW_WORKERS', 2))
+# Действия pull_request, на которые запускается ревью
+REVIEW_ACTIONS = frozenset({'opened', 'synchronize', 'reopened'})
+
+review_executor = ThreadPoolExecutor(max_workers=REVIEW_WORKERS, thread_name_prefix='pr-review')
+
+# Счётчик webhook по событию/action вместо info лога на каждый запрос
+# (только если установлен prometheus_client). Процесс один (gunicorn_conf.py),
+# поэтому счётчик не скачет между воркерами
+WEBHOOK_COUNT = Counter(
+    'gh_webhooks_total', 'Webhook GitHub с верной подписью', ['event', 'action']
+) if Counter is not None else None
+# Метрики отдаются отдельным HTTP сервером на localhost и только если задан порт:
+# на публичном listener webhook их нет
+METRICS_PORT = int(os.getenv('WEBHOOK_METRICS_PORT', 0))
+
+# Дедупликация: GitHub повторяет доставку при 5xx/таймауте (тот же
+# X-GitHub-Delivery), а двойной force-push шлёт synchronize с тем же head.
+# Ключи живут DELIVERY_TTL секунд в памяти процесса - поэтому gunicorn
+# запускается с одним воркером (gunicorn_conf.py), параллельность - потоками
+DELIVERY_TTL = 3600
+_seen_deliveries = OrderedDict()  # delivery id / (repo, pr, head sha) -> время
+_pending_reviews = {}  # (repo, pr) -> Future ещё не начатого ревью
+_dedup_lock = threading.RLock()  # cancel() вызывает done callback под блокировкой
+
+
+def _already_seen(key) -> bool:
+    """Отметить ключ доставки; True, если он уже встречался за DELIVERY_TTL"""
+    now = time.monotonic()
+    with _dedup_lock:
+        # Ключи добавляются по времени - устаревшие всегда в начале
+        while _seen_deliveries:
+            oldest, seen_at = next(iter(_seen_deliveries.items()))
+            if now - seen_at < DELIVERY_TTL:
+                break
+            _seen_deliveries.popitem(last=False)
+        if key in _seen_deliveries:
+            return True
+        _seen_deliveries[key] = now
+        return False
+
+
+def _forget_delivery(*keys):
+    """Снять отметки (доставка не обработана - повтор GitHub должен пройти)"""
+    with _dedup_lock:
+        for key in keys:
+            _seen_deliveries.pop(key, None)
+
+
+# Лимит ревью на репозиторий (token bucket): серия force-push не должна
+# превращаться в серию платных запросов к Claude. Корзины в памяти процесса:
+# лимит точный, пока сервер работает одним воркером (gunicorn_conf.py)
+REVIEW_RATE_PER_MIN = float(os.getenv('REVIEW_RATE_PER_MIN', 5))
+REVIEW_BURST = int(os.getenv('REVIEW_BURST', 10))
+_review_buckets = {}  # repo -> (токены, время последнего пополнения)
+_bucket_lock = threading.Lock()
+
 
-def verify_signature(payload_body, signature_header):
-    """Проверка подписи webhook от GitHub"""
+def _take_review_token(repo) -> bool:
+    """Взять токен на ревью репозитория; False, если лимит исчерпан"""
+    now = time.monotonic()
+    with _bucket_lock:
+        tokens, updated = _review_buckets.get(repo, (REVIEW_BURST, now))
+        tokens = min(REVIEW_BURST, tokens + (now - updated) * REVIEW_RATE_PER_MIN / 60)
+        allowed = tokens >= 1
+        _review_buckets[repo] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+
+def _submit_review(pr_key, payload):
+    """
+    Поставить ревью в очередь, отменив ещё не начатое ревью того же PR
+
+    Уже выполняющееся ревью не прерывается (поток не остановить),
+    но ожидающее в очереди устаревшего коммита - отменяется
+    """
+    with _dedup_lock:
+        previous = _pending_reviews.get(pr_key)
+        if previous is not None and previous.cancel():
+            logger.info("Отменено устаревшее ревью PR %s#%s", *pr_key)
+        future = review_executor.submit(process_pr_review, payload)
+        _pending_reviews[pr_key] = future
+    future.add_done_callback(lambda f: _review_done(pr_key, f))
+    return future
+
+
+def _review_done(pr_key, future):
+    """Убрать ревью из ожидающих и залогировать ошибку"""
+    with _dedup_lock:
+        if _pending_reviews.get(pr_key) is future:
+            del _pending_reviews[pr_key]
+    _log_review_failure(future)
+
+
+def _count_webhook(event_type, action=None):
+    """Учесть проверенный webhook в метриках"""
+    if WEBHOOK_COUNT is not None:
+        WEBHOOK_COUNT.labels(event_type or '-', action or '-').inc()
+
+
+def _log_review_failure(future):
+    """Залогировать исключение фонового ревью (иначе оно потеряется в Future)"""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        logger.error("Ошибка фонового ревью: %s", error)
+
+def _json_loads(data: bytes):
+    """Разобрать JSON тело запроса (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    """Сериализовать тело ответа в bytes (orjson, если установлен)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+# Готовые тела ответов: без jsonify (dict + dumps + согласование mimetype) на запрос
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+_INVALID_SIGNATURE = _json_dumps({'error': 'Invalid signature'})
+_DUPLICATE = _json_dumps({'status': 'duplicate'})
+_PONG = _json_dumps({'status': 'success', 'message': 'Pong!'})
+_PAYLOAD_TOO_LARGE = _json_dumps({'error': 'Payload too large'})
+_RATE_LIMITED = _json_dumps({'status': 'rate_limited'})
+_HEALTH = _json_dumps({'status': 'healthy', 'service': 'github-webhook-server'})
+
+
+# Поля pull_request события, которые нужны обработчику и process_pr_review.
+# Остальные ~2000 полей payload не хранятся в очереди ревью
+PR_PAYLOAD_FIELDS = (
+    'action',
+    'pull_request.number',
+    'pull_request.title',
+    'pull_request.body',
+    'pull_request.html_url',
+    'pull_request.user.login',
+    'pull_request.head.sha',
+    'repository.full_name',
+    'repository.name',
+    'repository.owner.login',
+)
+_PR_PAYLOAD_PATHS = {field: field.split('.') for field in PR_PAYLOAD_FIELDS}
+# Начиная с этого размера ijson (C backend) обходит тело потоково,
+# не строя полное дерево; на типичных payload orjson быстрее
+STREAM_PARSE_THRESHOLD = 512 * 1024
+
+
+def _set_path(payload: dict, path, value):
+    """Записать value во вложенный dict по пути ['a', 'b', 'c']"""
+    for key in path[:-1]:
+        payload = payload.setdefault(key, {})
+    payload[path[-1]] = value
+
+
+def _extract_pr_payload(body: bytes) -> dict:
+    """
+    Достать из тела pull_request события только PR_PAYLOAD_FIELDS
+
+    Возвращает dict той же структуры, что и полный payload GitHub
+    """
+    payload = {}
+    if ijson is not None and len(body) >= STREAM_PARSE_THRESHOLD:
+        remaining = len(_PR_PAYLOAD_PATHS)
+        for prefix, event, value in ijson.parse(io.BytesIO(body)):
+            path = _PR_PAYLOAD_PATHS.get(prefix)
+            if path is not None and event not in ('start_map', 'start_array'):
+                _set_path(payload, path, value)
+                remaining -= 1
+                if not remaining:
+                    break
+        return payload
+    
+    full = _json_loads(body)
+    for path in _PR_PAYLOAD_PATHS.values():
+        node = full
+        for key in path:
+            if not isinstance(node, dict) or key not in node:
+                break
+            node = node[key]
+        else:
+            _set_path(payload, path, node)
+    return payload
+
+
+class _SigningInput:
+    """wsgi.input, обновляющий HMAC каждым прочитанным куском тела"""
+
+    def __init__(self, stream, mac):
+        self._stream = stream
+        self._mac = mac
+
+    def read(self, *args):
+        chunk = self._stream.read(*args)
+        self._mac.update(chunk)
+        return chunk
+
+    def readline(self, *args):
+        line = self._stream.readline(*args)
+        self._mac.update(line)
+        return line
+
+
+class SignatureMiddleware:
+    """
+    Считает HMAC тела webhook во время чтения из сокета
+
+    Тело проходит через память один раз (чтение и хэширование вместе),
+    готовый HMAC доступен обработчику как environ['webhook.hmac']
+    """
+
+    def __init__(self, wsgi_app, path: str):
+        self.wsgi_app = wsgi_app
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if WEBHOOK_SECRET and environ.get('REQUEST_METHOD') == 'POST' \
+                and environ.get('PATH_INFO') == self.path:
+            mac = hmac.new(WEBHOOK_SECRET_BYTES, digestmod='sha256')
+            environ['wsgi.input'] = _SigningInput(environ['wsgi.input'], mac)
+            environ['webhook.hmac'] = mac
+        return self.wsgi_app(environ, start_response)
+
+
+app.wsgi_app = SignatureMiddleware(app.wsgi_app, '/webhook/github')
+
+
+def verify_signature(payload_body, signature_header, mac=None):
+    """
+    Проверка подписи webhook от GitHub
+
+    Args:
+        payload_body: тело запроса (bytes)
+        signature_header: значение X-Hub-Signature-256
+        mac: HMAC, посчитанный SignatureMiddleware при чтении тела
+    """
     if not WEBHOOK_SECRET:
         logger.warning("GITHUB_WEBHOOK_SECRET не установлен, пропускаю проверку")
         return True
     
-    hash_object = hmac.new(
-        WEBHOOK_SECRET.encode('utf-8'),
-        msg=payload_body,
-        digestmod=hashlib.sha256
-    )
-    expected_signature = "sha256=" + hash_object.hexdigest()
+    # Длина и префикс публичны: заведомо неверный заголовок отклоняем
+    # до HMAC по всему телу запроса
+    if len(signature_header) != SIGNATURE_LENGTH or not signature_header.startswith(SIGNATURE_PREFIX):
+        logger.error("Неверная подпись webhook")
+        return False
     
-    if not hmac.compare_digest(expected_signature, signature_header):
+    if mac is not None:
+        digest = mac.digest()
+    else:
+        # hmac.digest - один вызов OpenSSL (HMAC с аппаратным SHA-256, если есть)
+        digest = hmac.digest(WEBHOOK_SECRET_BYTES, payload_body, 'sha256')
+    
+    # Сравнивается только hex дайджеста (постоянное время), целиком в bytes.
+    # Не-ASCII символы заголовка заменяются на '?' и просто не совпадут
+    provided = signature_header[len(SIGNATURE_PREFIX):].encode('ascii', 'replace')
+    if not hmac.compare_digest(binascii.hexlify(digest), provided):
         logger.error("Неверная подпись webhook")
         return False
     return True
@@ -45,24 +329,40 @@ def verify_signature(payload_body, signature_header):
 @app.route('/webhook/github', methods=['POST'])
 def github_webhook():
     """Endpoint для получения webhook от GitHub"""
+    # Отметки дедупликации этого запроса: снимаются, если ревью не поставлено
+    # в очередь (иначе повторная доставка GitHub будет отброшена)
+    dedup_keys = []
     try:
         # Валидация подписи
+        # Одни и те же bytes идут в HMAC и в парсер JSON;
+        # cache=False - request не держит вторую копию тела
+        body = request.get_data(cache=False)
         signature = request.headers.get('X-Hub-Signature-256', '')
-        if not verify_signature(request.data, signature):
-            return jsonify({'error': 'Invalid signature'}), 401
+        if not verify_signature(body, signature, request.environ.get('webhook.hmac')):
+            return _INVALID_SIGNATURE, 401, _JSON_HEADERS
         
-        # Получение типа события
+        # Получение типа события (из заголовка - JSON разбираем только для pull_request)
         event_type = request.headers.get('X-GitHub-Event')
-        payload = request.json
         
-        logger.info(f"Получен webhook: {event_type}")
+        logger.debug("Получен webhook: %s", event_type)
         
         # Обработка Pull Request событий
         if event_type == 'pull_request':
+            # Повторная доставка того же события (ретрай GitHub)
+            delivery_id = request.headers.get('X-GitHub-Delivery')
+            if delivery_id and _already_seen(delivery_id):
+                _count_webhook(event_type, 'duplicate')
+                logger.info("Повторная доставка %s, пропускаю", delivery_id)
+                return _DUPLICATE, 200, _JSON_HEADERS
+            if delivery_id:
+                dedup_keys.append(delivery_id)
+            
+            payload = _extract_pr_payload(body)
             action = payload.get('action')
+            _count_webhook(event_type, action)
             
             # Реагируем на создание и обновление PR
-            if action in ['opened', 'synchronize', 'reopened']:
+            if action in REVIEW_ACTIONS:
                 pr_data = payload.get('pull_request', {})
                 repo_data = payload.get('repository', {})
                 
@@ -72,64 +372,89 @@ def github_webhook():
                 repo_full_name = repo_data.get('full_name')
                 
                 logger.info(
-                    f"PR #{pr_number} {action}: {pr_title} в {repo_full_name}"
+                    "PR #%s %s: %s в %s", pr_number, action, pr_title, repo_full_name
                 )
                 
-                # Асинхронная обработка ревью
-                try:
-                    process_pr_review(payload)
-                    return jsonify({
-                        'status': 'success',
-                        'message': f'Review started for PR #{pr_number}'
-                    }), 200
-                except Exception as e:
-                    logger.error(f"Ошибка при обработке PR: {e}")
-                    return jsonify({
-                        'status': 'error',
-                        'message': str(e)
-                    }), 500
+                # Тот же head коммит уже ревьюится (дублирующий synchronize).
+                # opened/reopened с прежним head - явный запрос ревью, не дубликат
+                head_sha = pr_data.get('head', {}).get('sha')
+                if action == 'synchronize' and head_sha:
+                    head_key = (repo_full_name, pr_number, head_sha)
+                    if _already_seen(head_key):
+                        logger.info("Ревью PR #%s для %.7s уже запущено", pr_number, head_sha)
+                        return _DUPLICATE, 200, _JSON_HEADERS
+                    dedup_keys.append(head_key)
+                
+                if not _take_review_token(repo_full_name):
+                    logger.warning("Лимит ревью для %s исчерпан, PR #%s пропущен", repo_full_name, pr_number)
+                    _count_webhook(event_type, 'rate_limited')
+                    _forget_delivery(*dedup_keys)
+                    return _RATE_LIMITED, 429, _JSON_HEADERS
+                
+                # Асинхронная обработка ревью: ставим в очередь и сразу отвечаем
+                _submit_review((repo_full_name, pr_number), payload)
+                return _json_dumps({
+                    'status': 'accepted',
+                    'message': f'Review started for PR #{pr_number}'
+                }), 202, _JSON_HEADERS
             else:
-                logger.info(f"Игнорируем action: {action}")
-                return jsonify({
+                logger.debug("Игнорируем action: %s", action)
+                return _json_dumps({
                     'status': 'ignored',
                     'message': f'Action {action} not processed'
-                }), 200
+                }), 200, _JSON_HEADERS
         
         # Ping event (для проверки webhook)
         elif event_type == 'ping':
+            _count_webhook(event_type)
             logger.info("Ping received from GitHub")
-            return jsonify({
-                'status': 'success',
-                'message': 'Pong!'
-            }), 200
+            return _PONG, 200, _JSON_HEADERS
         
         else:
-            logger.info(f"Неподдерживаемый тип события: {event_type}")
-            return jsonify({
+            # Штатно таких событий нет: webhook подписан только на pull_request
+            _count_webhook(event_type)
+            logger.debug("Неподдерживаемый тип события: %s", event_type)
+            return _json_dumps({
                 'status': 'ignored',
                 'message': f'Event type {event_type} not supported'
-            }), 200
+            }), 200, _JSON_HEADERS
             
+    except HTTPException:
+        # 413 и прочие HTTP ошибки отдаются своими обработчиками
+        raise
     except Exception as e:
-        logger.error(f"Ошибка при обработке webhook: {e}")
-        return jsonify({
+        logger.error("Ошибка при обработке webhook: %s", e)
+        _forget_delivery(*dedup_keys)
+        return _json_dumps({
             'status': 'error',
             'message': str(e)
-        }), 500
+        }), 500, _JSON_HEADERS
+
+@app.errorhandler(413)
+def payload_too_large(error):
+    """Слишком большое тело запроса (тело не читается)"""
+    logger.warning("Webhook отклонён: тело больше %d байт от %s", MAX_PAYLOAD_SIZE, request.remote_addr)
+    return _PAYLOAD_TOO_LARGE, 413, _JSON_HEADERS
 
-@app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
-        'service': 'github-webhook-server'
-    }), 200
+    """Health check endpoint (ответ - константа, при nginx отвечает сам nginx)"""
+    return _HEALTH, 200, _JSON_HEADERS
+
+app.add_url_rule('/health', view_func=health_check, methods=['GET'])
+
+if WEBHOOK_COUNT is not None and METRICS_PORT:
+    try:
+        start_http_server(METRICS_PORT, addr='127.0.0.1')
+        logger.info("Метрики Prometheus: http://127.0.0.1:%d/metrics", METRICS_PORT)
+    except OSError as e:
+        logger.error("Не удалось запустить сервер метрик на порту %d: %s", METRICS_PORT, e)
 
 if __name__ == '__main__':
     port = int(os.getenv('WEBHOOK_PORT', 8080))
-    logger.info(f"Запуск webhook сервера на порту {port}")
+    logger.info("Запуск webhook сервера на порту %s", port)
     
-    # В production используйте gunicorn/uwsgi
+    # Только для локальной отладки. В production:
+    # gunicorn webhook_server:app -c gunicorn_conf.py
     app.run(
         host='0.0.0.0',
         port=port,